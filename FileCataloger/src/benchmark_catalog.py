@@ -0,0 +1,315 @@
+#!/usr/bin/python
+"""
+Measure the throughput of the file catalog processing functions with synthetic data.
+
+For each combination of catalog size and burst size, a root folder with the post, temp, trash, store and screenshots folders and a catalog using the columns and column types in config.json is created.
+A burst of xlsx files (with new and updated rows) and pdf files (matching the new rows) is posted and processed by the same functions used by the file_catalog.py main loop, one stage at a time, without the infinite loop.
+
+Args (command line):
+    --rows: Catalog sizes, in rows. Default: 1000 10000 100000
+    --bursts: Number of xlsx and pdf files posted in each burst. Default: 10 100 1000
+    --rows-per-file: Rows in each xlsx file. Default: 20
+    --format: Catalog store formats to test (xlsx, parquet, feather, sqlite). Default: xlsx
+    --parse-workers: Parse worker processes. Default: number of CPUs
+    --root: Folder where the synthetic roots are created. Default: a temporary folder
+    --output: JSON file to save the results.
+    --keep: Keep the synthetic roots after the run.
+    --no-memory: Do not measure peak memory. Memory tracing slows down Python code, so use it for more accurate timings.
+
+Returns (stdout): Table with time, files/s, rows/s and peak memory for each stage.
+
+Peak memory is measured with tracemalloc in the main process and does not include the parse worker processes.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import file_catalog as fc
+
+# Global Constants
+TEMPLATE_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+STAGES = ["scan", "parse", "merge", "pdf", "export"]
+
+# --------------------------------------------------------------
+def synthetic_values(column: str, column_type: str, rows: int, tag: str) -> list:
+    """Return synthetic values for a column, matching the type defined in the column types of the config file, so that the catalog is read as a typed catalog.
+
+    Args:
+        column (str): Column name.
+        column_type (str): Type from the column types, or None for text.
+        rows (int): Number of values.
+        tag (str): Text added to the text values, to tell apart updated rows.
+
+    Returns:
+        list: Synthetic values.
+    """
+
+    match column_type:
+        case "category":
+            return [f"{column} {n % 5}" for n in range(rows)]
+        case "Int64":
+            return list(range(rows))
+        case "Float64":
+            return [n * 0.5 for n in range(rows)]
+        case "datetime":
+            return list(pd.date_range("2024-01-01", periods=rows, freq="min"))
+        case _:
+            return [f"{column} {tag} {n}" for n in range(rows)]
+
+# --------------------------------------------------------------
+def synthetic_rows(columns: list[str], key: str, keys: list[str], tag: str, column_types: dict) -> pd.DataFrame:
+    """Return a DataFrame with synthetic values for the given keys.
+
+    Args:
+        columns (list[str]): Columns to create.
+        key (str): Key column.
+        keys (list[str]): Values for the key column.
+        tag (str): Text added to the values, to tell apart updated rows.
+        column_types (dict): Column types from the config file.
+
+    Returns:
+        pd.DataFrame: Synthetic data.
+    """
+
+    data = {column: synthetic_values(column, column_types.get(column), len(keys), tag) for column in columns}
+    data[key] = keys
+
+    return pd.DataFrame(data, columns=columns)
+
+# --------------------------------------------------------------
+def build_root(root: str, catalog_rows: int, catalog_format: str, parse_workers: int) -> str:
+    """Create the folders, catalog and config file for a benchmark run.
+
+    Args:
+        root (str): Root folder to create.
+        catalog_rows (int): Number of rows in the catalog.
+        catalog_format (str): Catalog store format.
+        parse_workers (int): Parse worker processes.
+
+    Returns:
+        str: Path to the config file created.
+    """
+
+    with open(TEMPLATE_CONFIG, 'r', encoding='utf-8') as json_file:
+        raw = json.load(json_file)
+
+    raw["folders"]["root"] = root
+    raw["state folder"] = os.path.join(root, "state")
+    raw["last clean"] = pd.to_datetime("now").strftime("%Y-%m-%d %H:%M:%S")
+    raw["event watch"] = False
+    raw["parse workers"] = parse_workers
+    raw["log"]["screen output"] = False
+    raw["catalog store"] = {"format": catalog_format,
+                            "file": os.path.splitext(raw["catalog"])[0] + f".{catalog_format}",
+                            "export period in minutes": 0,
+                            "write window in seconds": 0}
+
+    for folder in ["post", "temp", "trash", "store", "screenshots"]:
+        os.makedirs(os.path.join(root, raw["folders"][folder]), exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.join(root, raw["log"]["file path"])), exist_ok=True)
+
+    config_file = os.path.join(root, "config.json")
+    with open(config_file, 'w', encoding='utf-8') as json_file:
+        json.dump(raw, json_file, indent=4)
+
+    columns_out = raw["columns"]["out"]
+    key = raw["columns"]["key"]
+    catalog_df = synthetic_rows(columns_out, key, [f"catalog_{n}.pdf" for n in range(catalog_rows)], "catalog", raw["columns"].get("types", {}))
+    catalog_df["status_screenshot"] = 0
+    catalog_file = os.path.join(root, raw["catalog"])
+
+    if catalog_format == "xlsx":
+        catalog_df.to_excel(catalog_file, index=False)
+        return config_file
+
+    # the catalog store is written directly, with an empty Excel catalog, to avoid writing large Excel files when testing other formats
+    catalog_df.head(0).to_excel(catalog_file, index=False)
+    load_config(config_file)
+    fc.write_catalog_store(catalog_df.set_index(key))
+    reset_state()
+
+    return config_file
+
+# --------------------------------------------------------------
+def post_burst(burst: int, rows_per_file: int, catalog_rows: int) -> int:
+    """Post xlsx and pdf files to the post folder. Half of the rows in each xlsx file update existing catalog rows and half are new rows, with a matching pdf file.
+
+    Args:
+        burst (int): Number of xlsx files and of pdf files.
+        rows_per_file (int): Rows in each xlsx file.
+        catalog_rows (int): Number of rows in the catalog.
+
+    Returns:
+        int: Number of rows posted.
+    """
+
+    columns_in = fc.config.raw["columns"]["in"]
+    key = fc.config.columns_key
+    updated = rows_per_file // 2
+
+    for n in range(burst):
+        keys = [f"catalog_{(n * updated + m) % catalog_rows}.pdf" for m in range(updated)]
+        keys += [f"new_{n}_{m}.pdf" for m in range(rows_per_file - updated)]
+        synthetic_rows(columns_in, key, keys, f"burst {n}", fc.config.column_types).to_excel(os.path.join(fc.config.post, f"burst_{n}.xlsx"), index=False)
+
+        with open(os.path.join(fc.config.post, f"new_{n}_0.pdf"), 'wb') as pdf_file:
+            pdf_file.write(b"%PDF-1.4\n%%EOF\n")
+
+    return burst * rows_per_file
+
+# --------------------------------------------------------------
+def load_config(config_file: str) -> None:
+    """Load the benchmark config file into the file_catalog module and start its log.
+
+    Args:
+        config_file (str): Config file to load.
+    """
+
+    fc.CONFIG_FILE = config_file
+    fc.config = fc.Config()
+    fc.start_logging()
+
+# --------------------------------------------------------------
+def reset_state() -> None:
+    """Reset the file_catalog module state kept between iterations, so that each run starts as a new process would."""
+
+    for db in (fc.catalog_db, fc.journal):
+        if db is not None:
+            db.close()
+
+    fc.reference_data = None
+    fc.reference_signature = None
+    fc.export_pending = False
+    fc.catalog_db = None
+    fc.journal = None
+    fc.pending_screenshots = {}
+    fc.in_flight = set()
+    fc.metrics = fc.Metrics()
+
+# --------------------------------------------------------------
+def measure(stage: str, files: int, rows: int, function, *args) -> tuple[object, dict]:
+    """Run a processing stage, measuring its duration and peak memory.
+
+    Args:
+        stage (str): Stage name.
+        files (int): Number of files handled by the stage, for the files/s rate.
+        rows (int): Number of rows handled by the stage, for the rows/s rate.
+        function (callable): Function to run.
+        *args: Arguments for the function.
+
+    Returns:
+        tuple[object, dict]: Function result and the stage measurements.
+    """
+
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, None)
+
+    return result, {"stage": stage,
+                    "seconds": round(seconds, 4),
+                    "files/s": round(files / seconds, 1) if files and seconds else None,
+                    "rows/s": round(rows / seconds, 1) if rows and seconds else None,
+                    "peak MB": round(peak / 2**20, 1) if peak is not None else None}
+
+# --------------------------------------------------------------
+def run(root: str, catalog_rows: int, burst: int, rows_per_file: int, catalog_format: str, parse_workers: int) -> list[dict]:
+    """Run all stages for one catalog size and burst size.
+
+    Args:
+        root (str): Root folder to create.
+        catalog_rows (int): Number of rows in the catalog.
+        burst (int): Number of xlsx and pdf files posted.
+        rows_per_file (int): Rows in each xlsx file.
+        catalog_format (str): Catalog store format.
+        parse_workers (int): Parse worker processes.
+
+    Returns:
+        list[dict]: Measurements for each stage.
+    """
+
+    shutil.rmtree(root, ignore_errors=True)
+    config_file = build_root(root, catalog_rows, catalog_format, parse_workers)
+    load_config(config_file)
+    posted_rows = post_burst(burst, rows_per_file, catalog_rows)
+
+    # read the catalog before measuring, as the resident reference data of a running service
+    fc.get_reference()
+
+    results = []
+    (xlsx_to_process, pdf_to_process), result = measure("scan", 2 * burst, 0, fc.get_files_to_process)
+    results.append(result)
+    (valid_files, new_data), result = measure("parse", len(xlsx_to_process), posted_rows, fc.parse_xlsx_files, xlsx_to_process)
+    results.append(result)
+    _, result = measure("merge", len(valid_files), posted_rows, fc.merge_xlsx_files, valid_files, new_data)
+    results.append(result)
+    _, result = measure("pdf", len(pdf_to_process), len(pdf_to_process), fc.process_pdf_files, pdf_to_process)
+    results.append(result)
+    _, result = measure("export", 1, catalog_rows + posted_rows, lambda: fc.export_catalog(fc.get_reference()))
+    results.append(result)
+
+    for result in results:
+        result.update({"format": catalog_format, "catalog rows": catalog_rows, "burst": burst})
+
+    reset_state()
+
+    return results
+
+# --------------------------------------------------------------
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(description="File catalog throughput benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--bursts", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rows-per-file", type=int, default=20)
+    parser.add_argument("--format", nargs="+", default=["xlsx"], choices=["xlsx", "parquet", "feather", "sqlite"])
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--root", default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--keep", action="store_true")
+    parser.add_argument("--no-memory", action="store_true")
+    args = parser.parse_args()
+
+    base = args.root or tempfile.mkdtemp(prefix="catalog_benchmark_")
+
+    if not args.no_memory:
+        tracemalloc.start()
+    results = []
+
+    try:
+        for catalog_format in args.format:
+            for catalog_rows in args.rows:
+                for burst in args.bursts:
+                    root = os.path.join(base, f"{catalog_format}_{catalog_rows}_{burst}")
+                    print(f"Running {catalog_format} catalog with {catalog_rows} rows and bursts of {burst} files...", file=sys.stderr)
+                    results.extend(run(root, catalog_rows, burst, args.rows_per_file, catalog_format, args.parse_workers))
+                    if not args.keep:
+                        shutil.rmtree(root, ignore_errors=True)
+    finally:
+        if fc.parse_pool is not None:
+            fc.parse_pool.shutdown()
+        if fc.io_pool is not None:
+            fc.io_pool.shutdown()
+        fc.stop_logging()
+        if not args.keep and not args.root:
+            shutil.rmtree(base, ignore_errors=True)
+
+    report = pd.DataFrame(results, columns=["format", "catalog rows", "burst", "stage", "seconds", "files/s", "rows/s", "peak MB"])
+    print(report.to_string(index=False))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as json_file:
+            json.dump(results, json_file, indent=4)
+
+if __name__ == "__main__":
+    main()
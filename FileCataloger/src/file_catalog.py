@@ -4,7 +4,7 @@ Check files in a folder and update a catalog file with new data.
 Keep folders clean by moving old files to a trash folder.
 Move files from post folder to get folder
 This module will not stop execution on errors except at startup, if log can't be started and key folders and files can't be accessed
-Log file is emptied on startup. Any existing log file is moved to the trash folder.
+Log file is rotated on startup and when it reaches the configured size or time. Log records are written by a background thread.
 
 Args (stdin): ctrl+c will soft stop the process similar to kill command or systemd stop <service>. kill -9 will hard stop.
 
@@ -15,6 +15,7 @@ Raises:
 """
 
 import logging
+import logging.handlers
 import sys
 import coloredlogs
 
@@ -23,19 +24,71 @@ import inspect
 
 import os
 import shutil
-import glob
+import errno
+from stat import S_ISDIR
 
 import json
+import sqlite3
+import hashlib
+import cProfile
+import pstats
+import tracemalloc
+import io
 import pandas as pd
+from openpyxl import Workbook
 import time
+import threading
+import queue
+from contextlib import contextmanager
+from typing import NamedTuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# the calamine engine is available in pandas since version 2.2
+try:
+    import python_calamine
+    EXCEL_ENGINE = "calamine" if tuple(int(part) for part in pd.__version__.split(".")[:2]) >= (2, 2) else None
+except ImportError:
+    EXCEL_ENGINE = None
 
 # Global Constants
 CONFIG_FILE = "C:/ProgramData/Anatel/FileCataloger/config.json"
+SCHEMA_TYPES = ("category", "string", "Int64", "Float64", "datetime")
+EXPORT_CHUNK_ROWS = 10000
 
 # Global variables
 config = None
 keep_watching = True
 log = None
+reference_data = None
+reference_signature = None
+export_pending = False
+last_export = 0
+persist_pending = False
+last_persist = 0
+unsaved_merges = []
+unsaved_files = set()
+unsaved_published = []
+catalog_db = None
+shard_index = None
+changed_keys = None
+parse_pool = None
+shared_pools = False
+pending_screenshots = {}
+journal = None
+journal_lock = threading.Lock()
+pending_lock = threading.Lock()
+io_pool_lock = threading.Lock()
+io_pool = None
+in_flight = set()
+posted_mtimes = {}
+trash_to_delete = []
+last_metrics = 0
+log_listener = None
 
 # --------------------------------------------------------------
 class Config:
@@ -45,9 +98,32 @@ class Config:
         """Load the configuration values from a JSON file encoded with UTF-8 and with the following tags:
             {
                 "check period in seconds":5,
+                "parse workers":4,
+                "io workers":8,
+                "io retries":3,
+                "io retry delay in seconds":0.5,
+                "queue size":4,
+                "scheduler":{
+                    "max check period in seconds":300,
+                    "files per cycle":1000,
+                    "xlsx priority in seconds":60},
+                "event watch":true,
+                "debounce in seconds":1,
                 "clean period in hours":24,
                 "last clean":"2021-09-30 15:00:00",
                 "overwrite data in trash": true,
+                "trash retention":{
+                    "max age in days":90, (null to keep files regardless of age)
+                    "max size in GB":50, (null to keep files regardless of the trash folder size)
+                    "files per cycle":1000},
+                "duplicate check in days":30,
+                "state folder":"C:/ProgramData/Anatel/FileCataloger",
+                "metrics":{
+                    "period in seconds":30,
+                    "prometheus file":"C:/ProgramData/Anatel/FileCataloger/file_catalog.prom",
+                    "status file":"C:/ProgramData/Anatel/FileCataloger/status.json",
+                    "profile request file":"C:/ProgramData/Anatel/FileCataloger/profile.request",
+                    "profile cycles":10},
                 "folders":{
                     "root":"D:/OneDrive",
                     "post":"post/Regulatron",
@@ -56,17 +132,29 @@ class Config:
                     "store":"store/Regulatron",
                     "screenshots":"get/Regulatron/Screenshots"},
                 "catalog":"get/Regulatron/Anuncios.xlsx",
+                "catalog store":{
+                    "format":"parquet", (xlsx, parquet, feather or sqlite)
+                    "file":"get/Regulatron/Anuncios.parquet",
+                    "export period in minutes":10,
+                    "export request file":"get/Regulatron/export.request",
+                    "write window in seconds":30,
+                    "streaming export":true, (write the Excel catalog row by row, with constant memory, instead of building the workbook in memory)
+                    "partition by":["marketplace", "data"]}, (optional, parquet or feather only, with file as the shards folder, for columns with category, string or datetime type, datetime columns partitioned by month)
                 "log":{
+                    "name":"Regulatron Catalog",
                     "level":"INFO",
                     "screen output":true,
                     "file output":true,
                     "file path":"get/Regulatron/log.txt",
                     "separator": " | ",
-                    "overwrite log in trash": false},
+                    "max size in MB": 10,
+                    "backup count": 5,
+                    "rotate when": null}, (null for size rotation or a TimedRotatingFileHandler interval, e.g. "midnight")
                 "columns":{
                     "in":["nome", "preço", "avaliações", "nota", "imagem", "url", "data", "palavra_busca", "página_de_busca", "certificado", "características", "descrição", "ean_gtin", "estado", "estoque", "imagens", "fabricante", "modelo", "product_id", "vendas", "vendedor", "screenshot", "indice", "subcategoria", "nome_sch", "fabricante_sch", "modelo_sch", "tipo_sch", "nome_score", "modelo_score", "passível?", "probabilidade", "marketplace"],
                     "out":["nome", "preço", "avaliações", "nota", "imagem", "url", "data", "palavra_busca", "página_de_busca", "certificado", "características", "descrição", "ean_gtin", "estado", "estoque", "imagens", "fabricante", "modelo", "product_id", "vendas", "vendedor", "screenshot", "indice", "subcategoria", "nome_sch", "fabricante_sch", "modelo_sch", "tipo_sch", "nome_score", "modelo_score", "passível?", "probabilidade", "marketplace", "status_screenshot"],
-                    "key":"screenshot"},
+                    "key":"screenshot",
+                    "types":{"marketplace":"category", "preço":"Float64", "data":"datetime", ...}}, (optional, with types category, string, Int64, Float64 or datetime)
                     
             }
         """
@@ -79,7 +167,23 @@ class Config:
         self.store = os.path.join(self.raw["folders"]["root"], self.raw["folders"]["store"])
         
         self.catalog = os.path.join(self.raw["folders"]["root"], self.raw["catalog"])
+
+        catalog_store = self.raw.get("catalog store", {})
+        self.catalog_format = catalog_store.get("format", "xlsx")
+        if self.catalog_format == "xlsx":
+            self.catalog_store = self.catalog
+        else:
+            self.catalog_store = os.path.join(self.raw["folders"]["root"], catalog_store["file"])
+        self.export_period = catalog_store.get("export period in minutes", 0)
+        self.write_window = catalog_store.get("write window in seconds", 0)
+        self.partition_by = catalog_store.get("partition by", [])
+        self.streaming_export = catalog_store.get("streaming export", False)
+        if catalog_store.get("export request file"):
+            self.export_request = os.path.join(self.raw["folders"]["root"], catalog_store["export request file"])
+        else:
+            self.export_request = None
         
+        self.log_name = self.raw["log"].get("name", "Regulatron Catalog")
         self.log_level = self.raw["log"]["level"]
         self.log_screen = self.raw["log"]["screen output"]
         self.log_file = self.raw["log"]["file output"]
@@ -88,18 +192,51 @@ class Config:
         self.log_file_format = self.__log_format_plain__()
         self.log_screen_format = self.__log_format_colour__()
         self.log_title = self.__log_titles__()
-        self.log_overwrite = self.raw["log"]["overwrite log in trash"]
+        self.log_max_bytes = int(self.raw["log"].get("max size in MB", 10) * 2**20)
+        self.log_backup_count = max(self.raw["log"].get("backup count", 5), 1)
+        self.log_rotate_when = self.raw["log"].get("rotate when", None)
         
         self.columns_in = sorted(self.raw["columns"]["in"])
         self.columns_out = self.raw["columns"]["out"]
         self.columns_key = self.raw["columns"]["key"]
+        self.column_types = self.raw["columns"].get("types", {})
         
         self.check_period = self.raw["check period in seconds"]
+        self.event_watch = self.raw.get("event watch", False)
+        self.debounce = self.raw.get("debounce in seconds", 1)
+        self.parse_workers = self.raw.get("parse workers", os.cpu_count())
+        self.io_workers = self.raw.get("io workers", 8)
+        self.io_retries = self.raw.get("io retries", 3)
+        self.io_retry_delay = self.raw.get("io retry delay in seconds", 0.5)
+        self.queue_size = self.raw.get("queue size", 4)
+
+        scheduler = self.raw.get("scheduler", {})
+        self.max_check_period = max(scheduler.get("max check period in seconds", self.check_period), self.check_period)
+        self.files_per_cycle = scheduler.get("files per cycle", 1000)
+        self.xlsx_priority = scheduler.get("xlsx priority in seconds", 60)
         self.clean_period = self.raw["clean period in hours"]
         
         self.last_clean = pd.to_datetime(self.raw["last clean"], format="%Y-%m-%d %H:%M:%S")
         
         self.data_overwrite = self.raw["overwrite data in trash"]
+
+        trash_retention = self.raw.get("trash retention", {})
+        self.trash_max_age = trash_retention.get("max age in days", None)
+        self.trash_max_size = trash_retention.get("max size in GB", None)
+        self.trash_files_per_cycle = trash_retention.get("files per cycle", 1000)
+        self.duplicate_days = self.raw.get("duplicate check in days", 30)
+
+        # local folder for files used to keep the script state between runs, that should not be synced
+        self.state_folder = self.raw.get("state folder", os.path.dirname(CONFIG_FILE))
+        self.pending_file = os.path.join(self.state_folder, "pending_screenshots.json")
+        self.journal_file = os.path.join(self.state_folder, "scan_state.sqlite")
+
+        metrics_config = self.raw.get("metrics", {})
+        self.metrics_period = metrics_config.get("period in seconds", 30)
+        self.metrics_file = metrics_config.get("prometheus file", os.path.join(self.state_folder, "file_catalog.prom"))
+        self.status_file = metrics_config.get("status file", os.path.join(self.state_folder, "status.json"))
+        self.profile_request = metrics_config.get("profile request file", os.path.join(self.state_folder, "profile.request"))
+        self.profile_cycles = metrics_config.get("profile cycles", 10)
         
         if not self.is_config_ok():
             exit(1)
@@ -217,10 +354,51 @@ class Config:
             print(f"Screenshots folder not found: {self.screenshots}")
             return False
         
-        if not os.path.exists(self.catalog):
+        if self.catalog_format not in ("xlsx", "parquet", "feather", "sqlite"):
+            print(f"Catalog store format not supported: {self.catalog_format}")
+            return False
+
+        for column, column_type in self.column_types.items():
+            if column not in self.columns_out or column == self.columns_key:
+                print(f"Column type defined for a column that is not an output column or is the key column: {column}")
+                return False
+            if column_type not in SCHEMA_TYPES:
+                print(f"Column type not supported for column {column}: {column_type}")
+                return False
+
+        if self.partition_by:
+            if self.catalog_format not in ("parquet", "feather"):
+                print(f"Catalog store partition requires the parquet or feather format, not {self.catalog_format}")
+                return False
+            for column in self.partition_by:
+                if column not in self.columns_out or column == self.columns_key:
+                    print(f"Catalog store partitioned by a column that is not an output column or is the key column: {column}")
+                    return False
+                # without a type, the values of a date column would create one shard for each distinct time
+                if self.column_types.get(column) not in ("category", "string", "datetime"):
+                    print(f"Catalog store partitioned by column {column} requires a category, string or datetime type in the column types")
+                    return False
+            if os.path.isfile(self.catalog_store):
+                print(f"Partitioned catalog store must be a folder, not a file: {self.catalog_store}")
+                return False
+
+        if self.catalog_format in ("parquet", "feather"):
+            try:
+                import pyarrow
+            except ImportError:
+                print(f"Catalog store format {self.catalog_format} requires the pyarrow package")
+                return False
+
+        if not os.path.exists(self.catalog) and not os.path.exists(self.catalog_store):
             print(f"Catalog file not found: {self.catalog}")
             return False
         
+        try:
+            os.makedirs(self.state_folder, exist_ok=True)
+        except Exception as e:
+            print(f"Error creating state folder: {e}")
+            return False
+
         if self.log_file:
             if not os.path.exists(os.path.dirname(self.log_filename)):
                 print(f"Log folder not found: {os.path.dirname(self.log_filename)}")
@@ -241,6 +419,487 @@ class Config:
         
         return True
 
+# --------------------------------------------------------------
+class FolderWatcher:
+    """Class to collect file system events from the post folder and release the changed paths after a debounce window.
+
+    Uses watchdog observers (inotify on Linux, ReadDirectoryChangesW on Windows). Paths are only released when no new event was received for them within the debounce window, to avoid picking up files that are still being written.
+    """
+
+    def __init__(self, folder: str, debounce: float) -> None:
+        """Start watching the folder recursively.
+
+        Args:
+            folder (str): Folder to watch.
+            debounce (float): Time in seconds without events before a path is considered ready.
+        """
+
+        self.folder = folder
+        self.debounce = debounce
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.new_event = threading.Event()
+
+        self.observer = Observer()
+        self.observer.schedule(self, folder, recursive=True)
+        self.observer.start()
+
+    # --------------------------------------------------------------
+    def dispatch(self, event) -> None:
+        """Register the paths affected by a file system event. Called from the observer thread.
+
+        Args:
+            event (watchdog.events.FileSystemEvent): Event received from the observer.
+        """
+
+        if event.event_type not in ("created", "modified", "moved", "closed"):
+            return
+
+        path = getattr(event, "dest_path", "") or event.src_path
+
+        with self.lock:
+            self.pending[path] = time.monotonic()
+
+        self.new_event.set()
+
+    # --------------------------------------------------------------
+    def wait_for_changes(self, timeout: float) -> list[str]:
+        """Wait until there are paths without events for the debounce window or until the timeout is reached.
+
+        Args:
+            timeout (float): Maximum time in seconds to wait.
+
+        Returns:
+            list[str]: Paths that are ready to be processed.
+        """
+
+        deadline = time.monotonic() + timeout
+
+        while keep_watching:
+            now = time.monotonic()
+
+            with self.lock:
+                ready = [path for path, last_event in self.pending.items() if now - last_event >= self.debounce]
+                for path in ready:
+                    del self.pending[path]
+
+                if self.pending:
+                    next_ready = min(self.pending.values()) + self.debounce
+                else:
+                    next_ready = deadline
+
+                self.new_event.clear()
+
+            if ready or now >= deadline:
+                return ready
+
+            # wake up at least every second to check for stop signals
+            self.new_event.wait(max(0, min(next_ready, deadline, now + 1) - now))
+
+        return []
+
+    # --------------------------------------------------------------
+    def stop(self) -> None:
+        """Stop the observer thread."""
+
+        self.observer.stop()
+        self.observer.join()
+
+# --------------------------------------------------------------
+class FolderEntry(NamedTuple):
+    """File or folder found when scanning a folder, with the stat values read in the scan."""
+
+    path: str
+    kind: str
+    size: int
+    mtime: float
+
+# --------------------------------------------------------------
+class Metrics:
+    """Class to record counters, gauges and stage timings of the catalog service, shared by all threads."""
+
+    def __init__(self) -> None:
+        """Start with no values recorded."""
+
+        # reentrant, so that a signal handler logging while this thread holds the lock does not wait on itself
+        self.lock = threading.RLock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+
+    # --------------------------------------------------------------
+    def add(self, name: str, value: float = 1, **labels) -> None:
+        """Add a value to a counter.
+
+        Args:
+            name (str): Counter name.
+            value (float): Value to add.
+            **labels: Labels identifying the counter, e.g. stage="merge".
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # --------------------------------------------------------------
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set the value of a gauge.
+
+        Args:
+            name (str): Gauge name.
+            value (float): Current value.
+            **labels: Labels identifying the gauge.
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    # --------------------------------------------------------------
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record the duration of a stage execution.
+
+        Args:
+            stage (str): Stage name, e.g. "scan" or "persist".
+            seconds (float): Duration in seconds.
+        """
+
+        with self.lock:
+            total, count, _ = self.timings.get(stage, (0, 0, 0))
+            self.timings[stage] = (total + seconds, count + 1, seconds)
+
+    # --------------------------------------------------------------
+    @contextmanager
+    def timer(self, stage: str):
+        """Context manager to record the duration of a stage execution.
+
+        Args:
+            stage (str): Stage name.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    # --------------------------------------------------------------
+    def prometheus(self) -> str:
+        """Return the values in the Prometheus text exposition format.
+
+        Returns:
+            str: Metrics text.
+        """
+
+        def line(name: str, labels: tuple, value: float) -> str:
+            if labels:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                return f"file_catalog_{name}{{{label_text}}} {value}"
+            return f"file_catalog_{name} {value}"
+
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE file_catalog_{name} counter")
+                lines.extend(line(name, labels, value) for (key, labels), value in sorted(self.counters.items()) if key == name)
+
+            for name in sorted({name for name, _ in self.gauges}):
+                lines.append(f"# TYPE file_catalog_{name} gauge")
+                lines.extend(line(name, labels, value) for (key, labels), value in sorted(self.gauges.items()) if key == name)
+
+            lines.append("# TYPE file_catalog_stage_seconds summary")
+            for stage, (total, count, _) in sorted(self.timings.items()):
+                lines.append(line("stage_seconds_sum", (("stage", stage),), total))
+                lines.append(line("stage_seconds_count", (("stage", stage),), count))
+
+            lines.append("# TYPE file_catalog_stage_last_seconds gauge")
+            for stage, (_, _, last) in sorted(self.timings.items()):
+                lines.append(line("stage_last_seconds", (("stage", stage),), last))
+
+            lines.append("# TYPE file_catalog_uptime_seconds gauge")
+            lines.append(line("uptime_seconds", (), time.time() - self.started))
+
+        return "\n".join(lines) + "\n"
+
+    # --------------------------------------------------------------
+    def status(self) -> dict:
+        """Return the values as a dictionary, to be written as JSON.
+
+        Returns:
+            dict: Status snapshot.
+        """
+
+        def name_with_labels(name: str, labels: tuple) -> str:
+            if labels:
+                return f"{name}{{{','.join(f'{key}={value}' for key, value in labels)}}}"
+            return name
+
+        with self.lock:
+            return {
+                "time": pd.to_datetime("now").strftime("%Y-%m-%d %H:%M:%S"),
+                "uptime seconds": round(time.time() - self.started),
+                "counters": {name_with_labels(name, labels): value for (name, labels), value in sorted(self.counters.items())},
+                "gauges": {name_with_labels(name, labels): value for (name, labels), value in sorted(self.gauges.items())},
+                "stages": {stage: {"count": count, "total seconds": round(total, 3), "last seconds": round(last, 3), "mean seconds": round(total / count, 3)}
+                           for stage, (total, count, last) in sorted(self.timings.items())}}
+
+# values recorded by all functions, including when used outside the main loop
+metrics = Metrics()
+
+# --------------------------------------------------------------
+class MemoryTracing:
+    """Class to start tracemalloc while it is used by at least one profile and stop it when the last one is done, since tracemalloc is shared by the whole process."""
+
+    def __init__(self) -> None:
+        """Start with no users."""
+
+        self.lock = threading.Lock()
+        self.users = 0
+        self.started = False
+
+    # --------------------------------------------------------------
+    def acquire(self) -> None:
+        """Start tracing memory allocations, unless already tracing."""
+
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                self.started = True
+            self.users += 1
+
+    # --------------------------------------------------------------
+    def release(self) -> None:
+        """Stop tracing memory allocations if started by acquire and no longer used."""
+
+        with self.lock:
+            self.users = max(0, self.users - 1)
+            if not self.users and self.started:
+                tracemalloc.stop()
+                self.started = False
+
+# users of tracemalloc in the process, shared by the profiles run by file_catalog_daemon.py
+memory_tracing = MemoryTracing()
+
+# --------------------------------------------------------------
+class Profiler:
+    """Class to profile the next cycles of the running service when requested, with a cProfile for each pipeline stage and tracemalloc snapshots of the memory allocations.
+
+    cProfile only records the thread where it is enabled, so each stage thread starts and stops its own profile around the work done in each cycle.
+    """
+
+    def __init__(self) -> None:
+        """Start with no profile requested."""
+
+        self.lock = threading.Lock()
+        self.requested = False
+        self.cycles_left = 0
+        self.profiles = {}
+        self.running = set()
+        self.tracing = False
+        self.first_snapshot = None
+
+    # --------------------------------------------------------------
+    def check_request(self) -> None:
+        """Start profiling the next profile cycles if requested by signal or by the profile request file, removing the request file."""
+
+        global log
+        global config
+
+        requested_by_file = config.profile_request is not None and os.path.exists(config.profile_request)
+        if not (self.requested or requested_by_file) or self.cycles_left or self.profiles:
+            return
+
+        self.requested = False
+        if requested_by_file:
+            try:
+                os.remove(config.profile_request)
+            except Exception as e:
+                log.warning(f"Error removing profile request file {config.profile_request}: {e}")
+
+        try:
+            memory_tracing.acquire()
+            self.tracing = True
+            self.first_snapshot = tracemalloc.take_snapshot()
+        except Exception as e:
+            log.warning(f"Error starting memory tracing, profiling without memory snapshots: {e}")
+
+        with self.lock:
+            self.cycles_left = max(1, config.profile_cycles)
+        log.info(f"Profiling the next {self.cycles_left} cycles.")
+
+    # --------------------------------------------------------------
+    def start(self, stage: str) -> None:
+        """Enable the profile of the stage while profiling, to be called by the stage thread before the work of each cycle.
+
+        Args:
+            stage (str): Stage name, one for each thread.
+        """
+
+        with self.lock:
+            if not self.cycles_left:
+                return
+            profile = self.profiles.setdefault(stage, cProfile.Profile())
+            self.running.add(stage)
+
+        profile.enable()
+
+    # --------------------------------------------------------------
+    def stop(self, stage: str) -> None:
+        """Disable the profile of the stage, to be called by the stage thread after the work of each cycle.
+
+        Args:
+            stage (str): Stage name, one for each thread.
+        """
+
+        with self.lock:
+            if stage not in self.running:
+                return
+            self.running.discard(stage)
+            profile = self.profiles[stage]
+
+        profile.disable()
+        self.finish()
+
+    # --------------------------------------------------------------
+    def end_cycle(self) -> None:
+        """Count a main loop cycle, to be called by the main loop after the work of each cycle."""
+
+        with self.lock:
+            if self.cycles_left:
+                self.cycles_left -= 1
+
+        self.finish()
+
+    # --------------------------------------------------------------
+    def finish(self) -> None:
+        """Write the report when the profile cycles are over and all stages stopped their profiles, from the thread of the last stage stopped."""
+
+        with self.lock:
+            if self.cycles_left or self.running or not self.profiles:
+                return
+            profiles = self.profiles
+            self.profiles = {}
+
+        # called from the pipeline stages, so errors are logged and never stop the stage thread
+        try:
+            self.write_report(profiles)
+        except Exception as e:
+            log.error(f"Error writing profile report: {e}")
+        finally:
+            if self.tracing:
+                self.tracing = False
+                memory_tracing.release()
+
+    # --------------------------------------------------------------
+    def write_report(self, profiles: dict) -> None:
+        """Write the profiles and the memory snapshot to files in the log folder, with a text summary of the functions with the highest cumulative time and of the largest allocations, and log the hot functions.
+
+        Args:
+            profiles (dict): cProfile.Profile of each stage.
+        """
+
+        global log
+        global config
+
+        first_snapshot = self.first_snapshot
+        self.first_snapshot = None
+
+        # named after the log file, so that profiles run by file_catalog_daemon.py with logs in the same folder do not overwrite each other's reports
+        log_base = os.path.splitext(config.log_filename)[0]
+        base = f"{log_base}_profile_{pd.to_datetime('now').strftime('%Y%m%d_%H%M%S')}"
+        summary = io.StringIO()
+
+        try:
+            for stage, profile in sorted(profiles.items()):
+                profile.dump_stats(f"{base}_{stage}.prof")
+                summary.write(f"==== {stage} stage, functions by cumulative time ====\n")
+                pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(30)
+
+            # memory allocated before the profile request, such as the reference data read at startup, is not in the snapshot
+            summary.write(f"==== Reference data in memory: {metrics.gauges.get(('reference_bytes', ()), 0) / 2**20:.1f} MB ====\n")
+
+            if first_snapshot is not None and tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+                snapshot.dump(f"{base}.tracemalloc")
+                summary.write("==== Largest allocations ====\n")
+                summary.writelines(f"{stat}\n" for stat in snapshot.statistics("lineno")[:30])
+                summary.write("\n==== Largest growth during the profile ====\n")
+                summary.writelines(f"{stat}\n" for stat in snapshot.compare_to(first_snapshot, "lineno")[:30])
+
+            with open(f"{base}.txt", 'w', encoding='utf-8') as summary_file:
+                summary_file.write(summary.getvalue())
+        except Exception as e:
+            log.error(f"Error writing profile report {base}: {e}")
+            return
+
+        # functions of this module with the highest cumulative time, added over all stages
+        stats = pstats.Stats(*profiles.values())
+        hot = sorted(((cumulative, function) for (file, _, function), (_, _, _, cumulative, _) in stats.stats.items()
+                      if os.path.basename(file) == os.path.basename(__file__) and not function.startswith("<") and function not in ("main", "parse_stage", "catalog_writer")),
+                     reverse=True)[:5]
+        log.info(f"Profile written to {base}.txt. Hot functions: " + ", ".join(f"{function} {cumulative:.2f} s" for cumulative, function in hot))
+
+# profile of the running service, requested by the profile request file or by SIGUSR1
+profiler = Profiler()
+
+# --------------------------------------------------------------
+class MetricsHandler(logging.Handler):
+    """Logging handler that counts the errors logged by each function, as errors by stage."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Count the error record. Stop signals are logged as critical, but are not errors.
+
+        Args:
+            record (logging.LogRecord): Log record.
+        """
+
+        if getattr(record, "stop_signal", False):
+            return
+
+        metrics.add("errors_total", stage=record.funcName)
+
+# --------------------------------------------------------------
+class TitleHeaderMixin:
+    """Mixin for file handlers that writes the log title at the start of each new log file."""
+
+    title = ""
+
+    def _open(self):
+        """Open the log file and write the title if the file is empty."""
+
+        stream = super()._open()
+        if stream.tell() == 0:
+            stream.write(self.title + "\n")
+            stream.flush()
+        return stream
+
+class TitledRotatingFileHandler(TitleHeaderMixin, logging.handlers.RotatingFileHandler):
+    """Log file handler rotated by size, with the log title at the start of each file."""
+
+class TitledTimedRotatingFileHandler(TitleHeaderMixin, logging.handlers.TimedRotatingFileHandler):
+    """Log file handler rotated by time, with the log title at the start of each file."""
+
+    def rotation_filename(self, default_name: str) -> str:
+        """Name the backup after the period and the time of the rollover, so that backups made in the same period do not replace each other.
+
+        Each run starts with a new log file, so several backups may be made in the same period. The names sort in the order the backups were made, as used to remove the oldest ones.
+
+        Args:
+            default_name (str): Backup name with the period suffix.
+
+        Returns:
+            str: Backup name that is not used by another backup.
+        """
+
+        name = f"{super().rotation_filename(default_name)}.{time.strftime('%H%M%S')}"
+        count = 0
+        candidate = name
+        while os.path.exists(candidate):
+            count += 1
+            candidate = f"{name}_{count}"
+        return candidate
+
 # --------------------------------------------------------------
 def sigterm_handler(signal=None, frame=None) -> None:
     """Signal handler for SIGTERM (Kill) to stop the process."""
@@ -249,7 +908,7 @@ def sigterm_handler(signal=None, frame=None) -> None:
     global log
 
     current_function = inspect.currentframe().f_back.f_code.co_name
-    log.critical(f"Kill signal received at: {current_function}()")
+    log.critical(f"Kill signal received at: {current_function}()", extra={"stop_signal": True})
     keep_watching = False
 
 # --------------------------------------------------------------
@@ -260,9 +919,15 @@ def sigint_handler(signal=None, frame=None) -> None:
     global log
 
     current_function = inspect.currentframe().f_back.f_code.co_name
-    log.critical(f"Ctrl+C received at: {current_function}()")
+    log.critical(f"Ctrl+C received at: {current_function}()", extra={"stop_signal": True})
     keep_watching = False
 
+# --------------------------------------------------------------
+def profile_handler(signal=None, frame=None) -> None:
+    """Signal handler for SIGUSR1 to profile the next cycles of the running service."""
+
+    profiler.requested = True
+
 # --------------------------------------------------------------
 def start_logging() -> bool:
     """Start the logging system with the configuration values from the config file and updating global variables.
@@ -272,8 +937,11 @@ def start_logging() -> bool:
     """
     global log
     global config
+    global log_listener
     
-    log = logging.getLogger('Regulatron Catalog')
+    log = logging.getLogger(config.log_name)
+
+    stop_logging()
     
     # Drop all existing handlers
     log.handlers.clear()
@@ -293,6 +961,9 @@ def start_logging() -> bool:
         case _:
             log.setLevel(logging.INFO)            
     
+    # handlers that write to screen and file are run by the listener thread, out of the processing path
+    handlers = []
+
     if config.log_screen:
         
         terminal_width = shutil.get_terminal_size().columns
@@ -303,23 +974,133 @@ def start_logging() -> bool:
         screen_formatter = coloredlogs.ColoredFormatter(fmt=config.log_screen_format)
         ch = logging.StreamHandler(stream=sys.stdout)
         ch.setFormatter(screen_formatter)
-        log.addHandler(ch)
+        handlers.append(ch)
     
     if config.log_file:
         
-        trash_it(config.log_filename, overwrite_trash=config.log_overwrite)
-        with open(config.log_filename, 'w') as log_file:
-            log_file.write(config.log_title + "\n")
-        
-        fh = logging.FileHandler(config.log_filename)
+        if config.log_rotate_when:
+            fh = TitledTimedRotatingFileHandler(config.log_filename,
+                                                when=config.log_rotate_when,
+                                                backupCount=config.log_backup_count,
+                                                delay=True)
+        else:
+            fh = TitledRotatingFileHandler(config.log_filename,
+                                           maxBytes=config.log_max_bytes,
+                                           backupCount=config.log_backup_count,
+                                           delay=True)
+        fh.title = config.log_title
+
+        # start each run with a new log file, keeping the previous ones as backups
+        if os.path.exists(config.log_filename) and os.path.getsize(config.log_filename) > 0:
+            fh.doRollover()
+
         file_formatter = logging.Formatter(fmt=config.log_file_format)
         fh.setFormatter(file_formatter)
-        log.addHandler(fh)
+        handlers.append(fh)
     
+    if handlers:
+        log_queue = queue.SimpleQueue()
+        log.addHandler(logging.handlers.QueueHandler(log_queue))
+        log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        log_listener.start()
+
+    mh = MetricsHandler(level=logging.ERROR)
+    log.addHandler(mh)
+
     log.info("Starting file catalog script...")
 
     return True
 
+# --------------------------------------------------------------
+def stop_logging() -> None:
+    """Stop the log listener thread, writing all queued log records, and close the log handlers."""
+
+    global log_listener
+
+    if log_listener is None:
+        return
+
+    log_listener.stop()
+    for handler in log_listener.handlers:
+        handler.close()
+    log_listener = None
+
+# --------------------------------------------------------------
+def copy_across_volumes(file: str, destination: str) -> None:
+    """Copy a file to a different volume, flushing it to disk under a temporary name that then replaces the destination. The source file is removed by the caller.
+
+    Args:
+        file (str): File to move.
+        destination (str): Path of the file in the destination folder.
+    """
+
+    temp_destination = f"{destination}.moving"
+    try:
+        with open(file, 'rb') as source, open(temp_destination, 'wb') as target:
+            shutil.copyfileobj(source, target, 2**20)
+            target.flush()
+            os.fsync(target.fileno())
+        shutil.copystat(file, temp_destination)
+        os.replace(temp_destination, destination)
+    except BaseException:
+        try:
+            os.remove(temp_destination)
+        except OSError:
+            pass
+        raise
+
+# --------------------------------------------------------------
+def move_file(file: str, folder: str, touch: bool = True) -> str:
+    """Move a file to a folder, with a rename if both are in the same volume or a copy otherwise, retrying with backoff while the file is locked, e.g. by OneDrive sync.
+
+    Args:
+        file (str): File to move.
+        folder (str): Destination folder.
+        touch (bool): True to reset the file timestamp to the current time.
+
+    Returns:
+        str: New path of the file.
+
+    Raises:
+        FileExistsError: If a file with the same name exists in the destination folder.
+        OSError: If the file could not be moved after all retries.
+    """
+
+    global log
+    global config
+
+    destination = os.path.join(folder, os.path.basename(file))
+    if os.path.exists(destination):
+        raise FileExistsError(errno.EEXIST, "Destination path already exists", destination)
+
+    # once the file is copied to the destination, only the removal of the source is retried
+    copied = False
+    for attempt in range(config.io_retries + 1):
+        try:
+            if not copied:
+                try:
+                    os.rename(file, destination)
+                    break
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                copy_across_volumes(file, destination)
+                copied = True
+            os.remove(file)
+            break
+        except PermissionError as e:
+            if attempt == config.io_retries:
+                raise
+            delay = config.io_retry_delay * 2**attempt
+            log.debug(f"File {file} locked, retrying in {delay} seconds: {e}")
+            metrics.add("move_retries_total")
+            time.sleep(delay)
+
+    if touch:
+        os.utime(destination)
+
+    return destination
+
 # --------------------------------------------------------------
 def move_to_temp(file: str) -> str:
     """Move a file to the temp folder, return the new path, resetting the file timestamp for the current time and log the event.
@@ -336,10 +1117,10 @@ def move_to_temp(file: str) -> str:
     
     filename = os.path.basename(file)
     try:
-        shutil.move(file, config.temp)
-        os.utime(os.path.join(config.temp, filename))
+        temp_file = move_file(file, config.temp)
         log.info(f"Moved to {config.temp} the file {filename}")
-        return os.path.join(config.temp, filename)
+        metrics.add("files_total", action="moved to temp")
+        return temp_file
     except Exception as e:
         log.error(f"Error moving {file} to temp folder: {e}")
         return file
@@ -379,9 +1160,10 @@ def trash_it(file: str, overwrite_trash:bool) -> None:
                 log.error(f"Error renaming {filename} in trash folder: {e}")
 
     try:
-        shutil.move(file, config.trash)
-        os.utime(trashed_file) # force the file timestamp to the current time to avoid being cleaned by the clean process before the clean period is over
+        move_file(file, config.trash) # file timestamp reset to the current time to avoid being deleted by the trash retention before the max age is over
+        posted_mtimes.pop(file, None)
         log.info(f"Moved to {config.trash} the file {filename}")
+        metrics.add("files_total", action="moved to trash")
     except Exception as e:
         log.error(f"Error moving {file} to trash folder: {e}")
         
@@ -398,9 +1180,10 @@ def move_to_store(file: str) -> None:
     
     filename = os.path.basename(file)
     try:
-        shutil.move(file, config.store)
-        os.utime(os.path.join(config.store, filename)) # force the file timestamp to the current time to avoid being cleaned by the clean process before the clean period is over
+        move_file(file, config.store) # file timestamp reset to the current time to avoid being cleaned by the clean process before the clean period is over
+        posted_mtimes.pop(file, None)
         log.info(f"Moved to {config.store} the file {filename}")
+        metrics.add("files_total", action="moved to store")
     except Exception as e:
         log.error(f"Error moving {file} to store folder: {e}")
 
@@ -417,68 +1200,169 @@ def publish(file: str) -> bool:
     
     filename = os.path.basename(file)
     try:
-        shutil.move(file, config.screenshots)
+        move_file(file, config.screenshots, touch=False)
         log.info(f"Published to {config.screenshots} the file {filename}")
+        metrics.add("files_total", action="published")
         return True
     except Exception as e:
         log.error(f"Error publishing {file} to screenshots folder: {e}")
         return False
 
 # --------------------------------------------------------------
-def sort_files_into_lists(  folder_content: list[str],
-                            move: bool = True,
-                            xlsx_to_process: list[str] = None,
-                            pdf_to_process: list[str] = None,
-                            subfolders: list[str] = None) -> tuple[list[str], list[str], list[str]]:
-    """Sort files in the provided listo into list of xlsx and pdf files to process and subfolders to remove.
+def io_map(function, items: list) -> list:
+    """Apply a file operation to all items using the I/O worker threads, returning the results in the same order.
 
     Args:
-        files (list[str]): List of files to sort.
-        move (bool): True if required to move files to the temp folder.
-        xlsx_to_process (list[str]): Existing list of xlsx files to process.
-        pdf_to_process (list[str]): Existing list of pdf files to process.
-        subfolders (list[str]): Existing list of subfolders to remove.
+        function (callable): File operation, such as move_to_temp or publish.
+        items (list): Items to process.
 
     Returns:
-        tuple[list[str], list[str], list[str]]: List of xlsx files to process, list of pdf files to process, list of subfolders to remove.
+        list: Results for each item.
     """
-    
-    global log
     global config
+    global io_pool
 
-    # Initialize lists if they are None
-    if xlsx_to_process is None:
-        xlsx_to_process = []
-    if pdf_to_process is None:
-        pdf_to_process = []
-    if subfolders is None:
-        subfolders = []
-        
-    for item in folder_content:
-        
-        # Check if the item is a file
-        if os.path.isfile(item):
-            
-            # Classify the file by extension
-            _, ext = os.path.splitext(item)
-            match ext:
-                
-                case '.xlsx':
-                    if move:                        
-                        item = move_to_temp(item)
+    if len(items) < 2 or config.io_workers < 2:
+        return [function(item) for item in items]
+
+    # the main thread and the catalog writer both move files, so the pool is created only once under the lock
+    with io_pool_lock:
+        if io_pool is None:
+            io_pool = ThreadPoolExecutor(max_workers=config.io_workers, thread_name_prefix="io")
+
+    return list(io_pool.map(function, items))
+
+# --------------------------------------------------------------
+def scan_folder(folder: str) -> list[FolderEntry]:
+    """Walk the folder recursively with a single directory listing per folder, reusing the stat values returned by the listing.
+
+    Subfolders are listed after their content, so that nested empty subfolders can be removed in order.
+
+    Args:
+        folder (str): Folder to scan.
+
+    Returns:
+        list[FolderEntry]: Files and subfolders found.
+    """
+
+    global log
+
+    folder_content = []
+
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        folder_content.extend(scan_folder(entry.path))
+                        folder_content.append(FolderEntry(entry.path, "folder", 0, 0))
+                    else:
+                        stat = entry.stat()
+                        folder_content.append(FolderEntry(entry.path, "file", stat.st_size, stat.st_mtime))
+                except OSError as e:
+                    # file removed or locked during the scan, will be found again in the next scan
+                    log.warning(f"Error reading {entry.path}: {e}")
+    except OSError as e:
+        log.warning(f"Error scanning folder {folder}: {e}")
+
+    return folder_content
+
+# --------------------------------------------------------------
+def scan_paths(paths: list[str]) -> list[FolderEntry]:
+    """Return the entries for a list of paths, scanning the content of the folders. Paths that no longer exist are ignored.
+
+    Args:
+        paths (list[str]): Files and folders to scan.
+
+    Returns:
+        list[FolderEntry]: Files and subfolders found.
+    """
+
+    folder_content = {}
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+
+        if S_ISDIR(stat.st_mode):
+            for entry in scan_folder(path):
+                folder_content[entry.path] = entry
+            folder_content[path] = FolderEntry(path, "folder", 0, 0)
+        else:
+            folder_content[path] = FolderEntry(path, "file", stat.st_size, stat.st_mtime)
+
+    return list(folder_content.values())
+
+# --------------------------------------------------------------
+def sort_files_into_lists(  folder_content: list[FolderEntry],
+                            move: bool = True,
+                            xlsx_to_process: list[str] = None,
+                            pdf_to_process: list[str] = None,
+                            subfolders: list[str] = None) -> tuple[list[str], list[str], list[str]]:
+    """Sort files in the provided listo into list of xlsx and pdf files to process and subfolders to remove.
+
+    Args:
+        folder_content (list[FolderEntry]): List of files and folders to sort.
+        move (bool): True if required to move files to the temp folder.
+        xlsx_to_process (list[str]): Existing list of xlsx files to process.
+        pdf_to_process (list[str]): Existing list of pdf files to process.
+        subfolders (list[str]): Existing list of subfolders to remove.
+
+    Returns:
+        tuple[list[str], list[str], list[str]]: List of xlsx files to process, list of pdf files to process, list of subfolders to remove.
+    """
+    
+    global log
+    global config
+
+    # Initialize lists if they are None
+    if xlsx_to_process is None:
+        xlsx_to_process = []
+    if pdf_to_process is None:
+        pdf_to_process = []
+    if subfolders is None:
+        subfolders = []
+        
+    new_xlsx = []
+    new_pdf = []
+    xlsx_mtimes = []
 
-                    xlsx_to_process.append(item)
+    for entry in folder_content:
+        item = entry.path
+        
+        # Check if the item is a file
+        if entry.kind == "file":
+            
+            # Classify the file by extension
+            _, ext = os.path.splitext(item)
+            match ext:
+                
+                case '.xlsx':
+                    new_xlsx.append(item)
+                    xlsx_mtimes.append(entry.mtime)
                     
                 case '.pdf':
-                    if move:
-                        item = move_to_temp(item)
-                    
-                    pdf_to_process.append(item)
+                    new_pdf.append(item)
                 
                 case _: 
                     trash_it(item, overwrite_trash=config.data_overwrite)
         else:
             subfolders.append(item)
+
+    if move:
+        posted_xlsx = new_xlsx
+        new_xlsx = io_map(move_to_temp, new_xlsx)
+        new_pdf = io_map(move_to_temp, new_pdf)
+
+        # the move resets the modification time, so the time the file was written is kept to merge the most recent data last
+        for posted, item, mtime in zip(posted_xlsx, new_xlsx, xlsx_mtimes):
+            if item != posted:
+                posted_mtimes[item] = mtime
+
+    xlsx_to_process.extend(new_xlsx)
+    pdf_to_process.extend(new_pdf)
             
     return xlsx_to_process, pdf_to_process, subfolders
 
@@ -495,12 +1379,28 @@ def remove_unused_subfolders(subfolders: list[str]) -> None:
     
     if subfolders:
         for folder in subfolders:
-            if not os.listdir(os.path.join(config.post, folder)):
-                try:
-                    os.rmdir(os.path.join(config.post, folder))
+            try:
+                if not os.listdir(folder):
+                    os.rmdir(folder)
                     log.info(f"Removed folder {folder}")
-                except Exception as e:
-                    log.warning(f"Error removing folder {folder}: {e}")
+            except Exception as e:
+                log.warning(f"Error removing folder {folder}: {e}")
+
+# --------------------------------------------------------------
+def get_temp_files_to_process() -> tuple[list[str], list[str], list[str]]:
+    """Return the files waiting in the temp folder, including files released to be processed again, e.g. after a failed catalog write.
+
+    Returns:
+        list[str]: List of xlsx files to process.
+        list[str]: List of pdf files to process.
+        list[str]: List of subfolders to remove.
+    """
+
+    global config
+
+    folder_content = resume_merged(scan_folder(config.temp))
+
+    return sort_files_into_lists(folder_content, move=False)
 
 # --------------------------------------------------------------
 def get_files_to_process() -> tuple[list[str], list[str]]:
@@ -515,25 +1415,19 @@ def get_files_to_process() -> tuple[list[str], list[str]]:
     global config
 
     # Get files from temp folder
-    folder_content = glob.glob("**", root_dir=config.temp, recursive=True)
+    xlsx_to_process, pdf_to_process, subfolders = get_temp_files_to_process()
     
-    if not folder_content:
+    if not (xlsx_to_process or pdf_to_process):
         log.info("TEMP Folder is empty.")
     else:
-        # add path to filenames
-        folder_content = list(map(lambda x: os.path.join(config.temp, x), folder_content))
-        log.info(f"TEMP Folder has {len(folder_content)} files/folders to process.")
+        log.info(f"TEMP Folder has {len(xlsx_to_process) + len(pdf_to_process)} files to process.")
 
-    xlsx_to_process, pdf_to_process, subfolders = sort_files_into_lists(folder_content, move=False)
-    
     # Get files from post folder
-    folder_content = glob.glob("**", root_dir=config.post, recursive=True)
+    folder_content = scan_folder(config.post)
     
     if not folder_content:
         log.info("POST Folder is empty.")
     else:
-        # add path to filenames
-        folder_content = list(map(lambda x: os.path.join(config.post, x), folder_content))
         log.info(f"POST Folder has {len(folder_content)} files/folders to process.")
         
     xlsx_to_process, pdf_to_process, subfolders = sort_files_into_lists(folder_content, xlsx_to_process=xlsx_to_process, pdf_to_process=pdf_to_process, subfolders=subfolders)
@@ -541,46 +1435,147 @@ def get_files_to_process() -> tuple[list[str], list[str]]:
     # Remove empty subfolders after moving files. New files that may have appeared in the subfolders will be processed in the next run
     remove_unused_subfolders(subfolders)
     
-    return xlsx_to_process, pdf_to_process
+    return xlsx_to_process, not_pending(pdf_to_process)
+
+# --------------------------------------------------------------
+def get_changed_files_to_process(changed: list[str]) -> tuple[list[str], list[str]]:
+    """Move the changed files reported by the folder watcher to the temp folder and return the list of files to process, with the files waiting in the temp folder.
+
+    The temp folder is small and local, so it is scanned in every call, to process again the files released by failed writes or publications without waiting for a full scan.
+
+    Args:
+        changed (list[str]): Paths reported by the folder watcher.
+
+    Returns:
+        list[str]: List of xlsx files to process.
+        list[str]: List of pdf files to process.
+    """
+
+    global log
+    global config
+
+    # Ignore the post folder itself. Folders moved into post may not report events for their content, so they are scanned
+    changed = [item for item in changed if os.path.abspath(item) != os.path.abspath(config.post)]
+    folder_content = scan_paths(changed)
+
+    xlsx_to_process, pdf_to_process, subfolders = get_temp_files_to_process()
+
+    if folder_content:
+        log.info(f"POST Folder has {len(folder_content)} changed files/folders to process.")
+        xlsx_to_process, pdf_to_process, subfolders = sort_files_into_lists(folder_content, xlsx_to_process=xlsx_to_process, pdf_to_process=pdf_to_process, subfolders=subfolders)
+
+    remove_unused_subfolders(subfolders)
+
+    return xlsx_to_process, not_pending(pdf_to_process)
 
 # --------------------------------------------------------------
 def clean_old_in_folder(folder: str) -> None:
-    """Move all files older than the clean period in hours from the post folder to the trash folder."""
+    """Move all files older than the clean period in hours from the folder to the trash folder."""
     
     global log
     global config
 
     # Get content from folder
-    folder_content = glob.glob("**", root_dir=folder, recursive=True)
+    folder_content = scan_folder(folder)
     
     if not folder_content:
         log.info(f"Nothing to clean in {folder}.")
         return
     
+    # files moved by this script have the modification time reset to the time of the move
+    cutoff = time.time() - config.clean_period * 3600
     folder_to_remove = []
     
-    for item in folder_content:
-            
-            item_name = os.path.join(folder, item)
-            # Check if the item is a file
-            if os.path.isfile(item_name):
-                
-                # Check if the file is older than the clean period
-                if pd.to_datetime(os.path.getctime(item_name), unit='s') < pd.to_datetime("now") - pd.Timedelta(hours=config.clean_period):
-                    trash_it(item_name, overwrite_trash=config.data_overwrite)
-            else:
-                folder_to_remove.append(item)
+    for entry in folder_content:
+        if entry.kind == "file":
+            if entry.mtime < cutoff:
+                trash_it(entry.path, overwrite_trash=config.data_overwrite)
+        else:
+            folder_to_remove.append(entry.path)
 
-    # Remove empty subfolders after moving files. 
-    if folder_to_remove:
-        for item in folder_to_remove:
-            # New files that may have appeared in the subfolders will be processed in the next run, so test if it is empty before removing
-            if not os.listdir(item):
-                try:
-                    os.rmdir(item)
-                    log.info(f"Removed folder {item}")
-                except Exception as e:
-                    log.warning(f"Error removing folder {item}: {e}")
+    # Remove empty subfolders after moving files. New files that may have appeared in the subfolders will be processed in the next run, so test if it is empty before removing
+    remove_unused_subfolders(folder_to_remove)
+
+# --------------------------------------------------------------
+def plan_trash_sweep() -> None:
+    """List the files to delete from the trash folder, oldest first, to keep it within the max age in days and the max size in GB.
+
+    The files are deleted in batches by sweep_trash, so that a large trash folder does not stall the main loop.
+    """
+
+    global log
+    global config
+    global trash_to_delete
+
+    if config.trash_max_age is None and config.trash_max_size is None:
+        return
+
+    with metrics.timer("trash scan"):
+        files = sorted((entry for entry in scan_folder(config.trash) if entry.kind == "file"), key=lambda entry: entry.mtime)
+
+    # files moved to trash by this script have the modification time reset to the time of the move
+    cutoff = time.time() - config.trash_max_age * 86400 if config.trash_max_age is not None else 0
+    max_bytes = config.trash_max_size * 2**30 if config.trash_max_size is not None else float("inf")
+    trash_bytes = sum(entry.size for entry in files)
+
+    metrics.set("trash_files", len(files))
+    metrics.set("trash_bytes", trash_bytes)
+
+    trash_to_delete = []
+    for entry in files:
+        if entry.mtime >= cutoff and trash_bytes <= max_bytes:
+            break
+        trash_to_delete.append(entry)
+        trash_bytes -= entry.size
+
+    if trash_to_delete:
+        log.info(f"Trash retention will delete {len(trash_to_delete)} files with {sum(entry.size for entry in trash_to_delete) / 2**20:.1f} MB from {config.trash}")
+
+# --------------------------------------------------------------
+def delete_from_trash(entry: FolderEntry) -> int:
+    """Delete a file from the trash folder.
+
+    Args:
+        entry (FolderEntry): File to delete, as found by plan_trash_sweep.
+
+    Returns:
+        int: Bytes reclaimed, 0 if the file was not deleted.
+    """
+
+    global log
+
+    try:
+        os.remove(entry.path)
+        return entry.size
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        log.warning(f"Error deleting {entry.path} from trash folder: {e}")
+        return 0
+
+# --------------------------------------------------------------
+def sweep_trash() -> None:
+    """Delete the next batch of files listed by plan_trash_sweep, up to the files per cycle of the trash retention, and report the bytes reclaimed."""
+
+    global log
+    global config
+    global trash_to_delete
+
+    if not trash_to_delete:
+        return
+
+    batch = trash_to_delete[:config.trash_files_per_cycle]
+    trash_to_delete = trash_to_delete[len(batch):]
+
+    with metrics.timer("trash sweep"):
+        reclaimed = io_map(delete_from_trash, batch)
+
+    deleted = sum(1 for size in reclaimed if size)
+    metrics.add("trash_deleted_total", deleted)
+    metrics.add("trash_reclaimed_bytes_total", sum(reclaimed))
+    metrics.set("trash_pending_delete", len(trash_to_delete))
+
+    log.info(f"Deleted {deleted} files from trash, reclaiming {sum(reclaimed) / 2**20:.1f} MB. {len(trash_to_delete)} files left to delete.")
 
 # --------------------------------------------------------------
 def read_excel(file: str) -> pd.DataFrame:
@@ -610,158 +1605,1899 @@ def read_excel(file: str) -> pd.DataFrame:
     return df_from_file
 
 # --------------------------------------------------------------
-def valid_data(df: pd.DataFrame) -> bool:
-    """Validate the data in the DataFrame.
+def catalog_signature() -> tuple[int, int]:
+    """Return the catalog store file modification time and size, used to detect changes made outside this process.
 
-    Args:
-        df (pd.DataFrame): DataFrame to validate.
+    Returns:
+        tuple[int, int]: Modification time in nanoseconds and size in bytes, or None if the file can't be accessed.
+    """
+    global config
+
+    if config.partition_by:
+        return shards_signature()
+
+    try:
+        stat = os.stat(config.catalog_store)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+# --------------------------------------------------------------
+def read_catalog_store() -> pd.DataFrame:
+    """Read the reference data from the catalog store file.
+
+    If the catalog store file does not exist yet, it is created from the Excel catalog file.
 
     Returns:
-        bool: True if the data is valid.
+        pd.DataFrame: DataFrame with the reference data.
     """
     global log
     global config
-    
-    df_columns = df.columns.tolist()
-    df_columns.append(df.index.name)
 
-    if sorted(df_columns) != config.columns_in:
-        return False
-    
-    return True
+    if config.catalog_format == "xlsx":
+        return apply_schema(read_excel(config.catalog), config.catalog)
+
+    if config.catalog_format != "sqlite" and (not os.path.exists(config.catalog_store) or (config.partition_by and not shard_files())):
+        log.info(f"Creating catalog store {config.catalog_store} from {config.catalog}")
+        reference_df = apply_schema(read_excel(config.catalog), config.catalog)
+        if reference_df.index.name == config.columns_key:
+            if config.partition_by:
+                os.makedirs(config.catalog_store, exist_ok=True)
+                reset_shards(None)
+            write_catalog_store(reference_df)
+        return reference_df
+
+    try:
+        match config.catalog_format:
+            case _ if config.partition_by:
+                reference_df = pd.concat([read_columnar_file(file) for file in shard_files()])
+            case "parquet" | "feather":
+                reference_df = read_columnar_file(config.catalog_store)
+            case "sqlite":
+                reference_df = pd.read_sql_query("SELECT * FROM catalog", get_catalog_db(), index_col=config.columns_key)
+    except Exception as e:
+        log.error(f"Error reading catalog store {config.catalog_store}: {e}")
+        return pd.DataFrame()
+
+    reference_df = apply_schema(reference_df, config.catalog_store)
+
+    if config.partition_by:
+        reset_shards(shard_labels(reference_df))
+
+    return reference_df
 
 # --------------------------------------------------------------
-def process_xlsx_files(xlsx_to_process: list[str]) -> pd.DataFrame:
-    """Process the list of xlsx files and update the reference data file.
+def convert_column(column: pd.Series, column_type: str) -> tuple[pd.Series, int]:
+    """Convert the column to the type defined in the column types schema.
 
     Args:
-        xlsx_to_process (list[str]): List of xlsx files to process.
-        config (Config): Configuration object.
-        log (logging.Logger): Logger object.
+        column (pd.Series): Column to convert.
+        column_type (str): Type from the schema, one of SCHEMA_TYPES.
+
+    Returns:
+        tuple[pd.Series, int]: Converted column and the number of values that could not be converted, lost in the conversion.
+    """
+
+    match column_type:
+        case "category":
+            return column.astype("category"), 0
+        case "string":
+            return column.astype("string"), 0
+        case "Int64" | "Float64":
+            converted = pd.to_numeric(column, errors="coerce")
+            invalid = converted.isna() & column.notna()
+            if column_type == "Int64":
+                invalid |= converted.notna() & (converted % 1 != 0)
+            if invalid.any():
+                return converted, int(invalid.sum())
+            return converted.astype(column_type), 0
+        case "datetime":
+            converted = pd.to_datetime(column, errors="coerce")
+            return converted, int((converted.isna() & column.notna()).sum())
+
+# --------------------------------------------------------------
+def apply_schema(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    """Convert the columns to the types defined in the column types schema, to reduce the memory used and speed up merges.
+
+    Columns with values that can't be converted are kept unchanged and reported in the log.
+
+    Args:
+        df (pd.DataFrame): DataFrame to convert, changed in place.
+        source (str): File or description of the data, for the log.
+
+    Returns:
+        pd.DataFrame: Converted DataFrame.
     """
-    
     global log
     global config
-    
-    reference_df = read_excel(config.catalog)
-    
-    for file in xlsx_to_process:
-        new_data_df = read_excel(file)
 
-        if not valid_data(new_data_df):
-            trash_it(file, overwrite_trash=config.data_overwrite)
+    for column, column_type in config.column_types.items():
+        if column not in df.columns or df[column].dtype.name == column_type:
             continue
-        
-        # update the reference data with the new data where index matches
-        reference_df.update(new_data_df)
-        
-        # add new_data_df rows where index does not match
-        reference_df = reference_df.combine_first(new_data_df)
-        
-        persist_reference(reference_df)
-        
-        move_to_store(file)
+        if column_type == "datetime" and pd.api.types.is_datetime64_any_dtype(df[column]):
+            continue
+
+        try:
+            converted, invalid = convert_column(df[column], column_type)
+        except Exception as e:
+            log.warning(f"Column {column} in {source} not converted to {column_type}: {e}")
+            continue
+
+        if invalid:
+            log.warning(f"Column {column} in {source} not converted to {column_type}, {invalid} values are not valid.")
+            continue
+
+        df[column] = converted
+
+    return df
 
 # --------------------------------------------------------------
-def process_pdf_files(pdf_to_process: list[str]) -> None:
-    """Process the list of pdf files and update the reference data file.
+def align_schema(reference_df: pd.DataFrame, new_data_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Align the column types of the new data with the reference data, so that merges keep the types of the reference data.
+
+    Categorical columns get the union of the categories of both DataFrames. Columns of the reference data that have a different type in the new data, e.g. since some new values could not be converted, are converted to object.
 
     Args:
-        pdf_to_process (list[str]): List of pdf files to process.
-        reference_df (pd.DataFrame): Reference data DataFrame.
-        log (logging.Logger): Logger object.
+        reference_df (pd.DataFrame): Reference data, changed in place.
+        new_data_df (pd.DataFrame): New data.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: Reference data and new data with aligned types.
     """
     global log
     global config
-        
-    reference_df = read_excel(config.catalog)
-    
-    for item in pdf_to_process:
-        filename = os.path.basename(item)
-        if filename in reference_df.index:
-            reference_df.at[filename, "status_screenshot"] = 1
-            if publish(item):
-                persist_reference(reference_df)
-            
-        else:
-            # if file is not present in the reference_df, just do nothing and wait for it to appear later.
-            log.info(f"{filename} not found in the reference data.")
 
-    
+    new_data_df = new_data_df.copy(deep=False)
+
+    for column in new_data_df.columns.intersection(reference_df.columns):
+        reference_type = reference_df[column].dtype
+        new_type = new_data_df[column].dtype
+
+        if isinstance(reference_type, pd.CategoricalDtype) and isinstance(new_type, pd.CategoricalDtype):
+            categories = reference_type.categories.union(new_type.categories)
+            if len(categories) != len(reference_type.categories):
+                reference_df[column] = reference_df[column].cat.set_categories(categories)
+            new_data_df[column] = new_data_df[column].cat.set_categories(categories)
+        elif reference_type != new_type and column in config.column_types:
+            log.warning(f"Column {column} in the reference data converted from {reference_type} to object, to merge new data with type {new_type}.")
+            reference_df[column] = reference_df[column].astype(object)
+
+    return reference_df, new_data_df
+
 # --------------------------------------------------------------
-def persist_reference(reference_df: pd.DataFrame) -> None:
-    """Persist the reference DataFrame to the catalog file.
+def columnar_frame(reference_df: pd.DataFrame) -> pd.DataFrame:
+    """Return the DataFrame with columns mixing numbers and text converted to text, since columnar formats require a single type per column.
 
     Args:
-        reference_df (pd.DataFrame): The reference DataFrame to be saved.
+        reference_df (pd.DataFrame): DataFrame to convert.
+
+    Returns:
+        pd.DataFrame: DataFrame that can be written to a columnar file.
     """
-    global log
-    global config
 
-    # Make a copy of the DataFrame to avoid modifying the original
-    reference_df = reference_df.copy()
-    
-    # change index column to a regular column so it is exported to the Excel file
-    reference_df.reset_index(inplace=True)
-    
-    # reorder columns to match order defined the config file as columns_out
-    reference_df = reference_df[config.columns_out]
-    
-    try:
-        reference_df.to_excel(config.catalog, index=False)
-        log.info(f"Reference data file updated: {config.catalog}")
-    except Exception as e:
-        log.error(f"Error saving reference data: {e}")
+    mixed_columns = [column for column in reference_df.columns
+                        if reference_df[column].dtype == object
+                        and pd.api.types.infer_dtype(reference_df[column], skipna=True) in ("mixed", "mixed-integer")]
+
+    if not mixed_columns:
+        return reference_df
+
+    reference_df = reference_df.copy(deep=False)
+    for column in mixed_columns:
+        reference_df[column] = reference_df[column].map(lambda x: x if pd.isna(x) else str(x))
+
+    return reference_df
 
 # --------------------------------------------------------------
-def clean_folders() -> None:
-    """Check if it's time to clean the post folder and update the last clean time in the config file."""
+def write_catalog_store(reference_df: pd.DataFrame) -> None:
+    """Write the reference data to the catalog store file, or to the catalog shards changed since the last write if the catalog store is partitioned.
+
+    Args:
+        reference_df (pd.DataFrame): The reference DataFrame to be saved.
+    """
     global config
 
-    if pd.to_datetime("now") - config.last_clean > pd.Timedelta(hours=config.clean_period):
-        clean_old_in_folder(config.post)
-        clean_old_in_folder(config.temp)
-        config.set_last_clean()
+    match config.catalog_format:
+        case "sqlite":
+            upsert_catalog_db(reference_df)
+        case _ if config.partition_by:
+            write_catalog_shards(reference_df)
+        case _:
+            write_columnar_file(reference_df, config.catalog_store)
 
 # --------------------------------------------------------------
-# Main function
-# --------------------------------------------------------------
+def read_columnar_file(file: str) -> pd.DataFrame:
+    """Read a parquet or feather file written by write_columnar_file.
 
-# Register the signal handler function, to handle system kill commands
-signal.signal(signal.SIGTERM, sigterm_handler)
-signal.signal(signal.SIGINT, sigint_handler)
+    Args:
+        file (str): File to read.
 
-def main():
-    """Main function"""
-    
+    Returns:
+        pd.DataFrame: DataFrame indexed by the key column.
+    """
+    global config
+
+    if config.catalog_format == "parquet":
+        return pd.read_parquet(file)
+
+    return pd.read_feather(file).set_index(config.columns_key)
+
+# --------------------------------------------------------------
+def write_columnar_file(reference_df: pd.DataFrame, file: str) -> None:
+    """Write the DataFrame to a parquet or feather file.
+
+    Args:
+        reference_df (pd.DataFrame): DataFrame indexed by the key column.
+        file (str): File to write.
+    """
+    global config
+
+    # columnar files are written to a temporary file and then replaced, so readers and sync clients never see a partial file
+    temp_file = f"{file}.tmp"
+
+    if config.catalog_format == "parquet":
+        columnar_frame(reference_df).to_parquet(temp_file)
+    else:
+        columnar_frame(reference_df).reset_index().to_feather(temp_file)
+
+    os.replace(temp_file, file)
+
+# --------------------------------------------------------------
+def shard_files() -> list[str]:
+    """Return the catalog shard files in the catalog store folder.
+
+    Returns:
+        list[str]: Shard files.
+    """
+    global config
+
+    extension = f".{config.catalog_format}"
+    with os.scandir(config.catalog_store) as entries:
+        return sorted(entry.path for entry in entries if entry.is_file() and entry.name.endswith(extension))
+
+# --------------------------------------------------------------
+def shards_signature() -> tuple[int, int, int]:
+    """Return the latest modification time, the total size and the number of the catalog shard files, used to detect changes made outside this process.
+
+    Returns:
+        tuple[int, int, int]: Modification time in nanoseconds, size in bytes and number of files, or None if the folder can't be accessed.
+    """
+    global config
+
+    try:
+        # the folder modification time changes when shards are added or removed
+        stats = [os.stat(config.catalog_store)] + [os.stat(file) for file in shard_files()]
+    except OSError:
+        return None
+
+    return (max(stat.st_mtime_ns for stat in stats), sum(stat.st_size for stat in stats[1:]), len(stats) - 1)
+
+# --------------------------------------------------------------
+def shard_labels(reference_df: pd.DataFrame) -> pd.Series:
+    """Return the shard of each row, named by the values of the partition columns, with datetime columns by month and values that are not dates in the none shard.
+
+    Args:
+        reference_df (pd.DataFrame): DataFrame indexed by the key column.
+
+    Returns:
+        pd.Series: Shard name for each key.
+    """
+    global config
+
+    labels = pd.Series("", index=reference_df.index, dtype=object)
+
+    for number, column in enumerate(config.partition_by):
+        values = reference_df[column]
+        if config.column_types[column] == "datetime":
+            # the column is kept as read if any value could not be converted by apply_schema, so it is converted again here
+            values, _ = convert_column(values, "datetime")
+            values = values.dt.strftime("%Y-%m")
+        values = values.astype(object).where(values.notna(), "none").astype(str)
+        labels = labels + ("__" if number else "") + f"{column}=" + values.str.replace(r"[^\w.-]+", "-", regex=True)
+
+    return labels
+
+# --------------------------------------------------------------
+def reset_shards(labels: pd.Series) -> None:
+    """Set the shard of each row as found in the catalog store, with no changes to write.
+
+    Args:
+        labels (pd.Series): Shard name for each key, or None if the shards are unknown, to write all shards in the next write.
+    """
+    global shard_index
+    global changed_keys
+
+    shard_index = labels
+    changed_keys = set() if labels is not None else None
+
+# --------------------------------------------------------------
+def write_catalog_shards(reference_df: pd.DataFrame) -> None:
+    """Write the catalog shards with rows changed since the last write, including the shards where changed rows were before, so that the write cost is bounded by the shards changed and not by the size of the catalog.
+
+    Args:
+        reference_df (pd.DataFrame): The reference DataFrame to be saved.
+    """
+    global log
+    global config
+    global shard_index
+    global changed_keys
+
+    extension = f".{config.catalog_format}"
+
+    if shard_index is None or changed_keys is None:
+        # all shards are written and shards no longer used are removed
+        labels = shard_labels(reference_df)
+        touched = set(labels.unique())
+        stale = [file for file in shard_files() if os.path.basename(file)[:-len(extension)] not in touched]
+    else:
+        keys = reference_df.index.intersection(list(changed_keys))
+        new_labels = shard_labels(reference_df.loc[keys])
+        touched = set(new_labels.unique()).union(shard_index.reindex(keys).dropna().unique())
+        labels = pd.concat([shard_index[~shard_index.index.isin(keys)], new_labels])
+        stale = []
+
+    written = 0
+    written_bytes = 0
+    for shard in sorted(touched):
+        file = os.path.join(config.catalog_store, f"{shard}{extension}")
+        shard_df = reference_df.loc[labels.index[labels.values == shard]]
+        if shard_df.empty:
+            stale.append(file)
+            continue
+        write_columnar_file(shard_df, file)
+        written += 1
+        written_bytes += file_size(file)
+
+    for file in stale:
+        os.remove(file)
+
+    reset_shards(labels)
+
+    metrics.add("shards_written_total", written)
+    metrics.set("persist_bytes", written_bytes)
+    log.info(f"Wrote {written} catalog shards to {config.catalog_store}")
+
+# --------------------------------------------------------------
+def quote(name: str) -> str:
+    """Return the column name quoted to be used as an SQL identifier.
+
+    Args:
+        name (str): Column name.
+
+    Returns:
+        str: Quoted column name.
+    """
+
+    return '"' + name.replace('"', '""') + '"'
+
+# --------------------------------------------------------------
+def get_catalog_db() -> sqlite3.Connection:
+    """Return the connection to the SQLite catalog store, creating the catalog table if needed.
+
+    The table has one column for each output column, with the key column as primary key.
+    A new catalog store is filled with the data from the Excel catalog file.
+
+    Returns:
+        sqlite3.Connection: Connection to the catalog database.
+    """
+    global log
+    global config
+    global catalog_db
+
+    if catalog_db is None:
+        new_store = not os.path.exists(config.catalog_store)
+
+        # opened by the main thread at startup and used by the catalog writer thread after that
+        catalog_db = sqlite3.connect(config.catalog_store, check_same_thread=False)
+        catalog_db.execute("PRAGMA journal_mode=WAL")
+
+        columns = [f"{quote(column)} PRIMARY KEY" if column == config.columns_key else quote(column) for column in config.columns_out]
+        catalog_db.execute(f"CREATE TABLE IF NOT EXISTS catalog ({', '.join(columns)})")
+        catalog_db.commit()
+
+        if new_store and os.path.exists(config.catalog):
+            log.info(f"Creating catalog store {config.catalog_store} from {config.catalog}")
+            upsert_catalog_db(read_excel(config.catalog))
+
+    return catalog_db
+
+# --------------------------------------------------------------
+def upsert_catalog_db(new_data_df: pd.DataFrame) -> None:
+    """Insert new rows and update existing rows in the SQLite catalog store.
+
+    As with DataFrame.update, existing values are only replaced by values that are not null.
+
+    Args:
+        new_data_df (pd.DataFrame): DataFrame with new data, indexed by the key column.
+    """
+    global config
+
+    new_data_df = new_data_df.reset_index()
+    columns = [column for column in new_data_df.columns if column in config.columns_out]
+
+    # dates are stored as text, as SQLite has no date type
+    dates = {column: new_data_df[column].dt.strftime("%Y-%m-%d %H:%M:%S")
+             for column in columns if pd.api.types.is_datetime64_any_dtype(new_data_df[column])}
+
+    new_data_df = new_data_df[columns].assign(**dates).astype(object)
+    rows = new_data_df.where(new_data_df.notna(), None).values.tolist()
+
+    column_list = ", ".join(quote(column) for column in columns)
+    value_list = ", ".join("?" for _ in columns)
+    update_list = ", ".join(f"{quote(column)} = COALESCE(excluded.{quote(column)}, catalog.{quote(column)})"
+                            for column in columns if column != config.columns_key)
+
+    catalog_db = get_catalog_db()
+    with catalog_db:
+        catalog_db.executemany(f"INSERT INTO catalog ({column_list}) VALUES ({value_list}) "
+                               f"ON CONFLICT({quote(config.columns_key)}) DO UPDATE SET {update_list}", rows)
+
+# --------------------------------------------------------------
+def catalog_db_keys(keys: list[str]) -> set[str]:
+    """Return the keys that are present in the SQLite catalog store.
+
+    Args:
+        keys (list[str]): Keys to search.
+
+    Returns:
+        set[str]: Keys found in the catalog.
+    """
+    global config
+
+    found = set()
+    catalog_db = get_catalog_db()
+    key = quote(config.columns_key)
+
+    # limit the number of parameters in each query
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        query = f"SELECT {key} FROM catalog WHERE {key} IN ({', '.join('?' for _ in chunk)})"
+        found.update(row[0] for row in catalog_db.execute(query, chunk))
+
+    return found
+
+# --------------------------------------------------------------
+def set_status_catalog_db(keys: list[str]) -> None:
+    """Set the screenshot status for the keys in the SQLite catalog store.
+
+    Args:
+        keys (list[str]): Keys of the published screenshots.
+    """
+    global config
+
+    catalog_db = get_catalog_db()
+    with catalog_db:
+        catalog_db.executemany(f"UPDATE catalog SET status_screenshot = 1 WHERE {quote(config.columns_key)} = ?", [(key,) for key in keys])
+
+# --------------------------------------------------------------
+def get_reference() -> pd.DataFrame:
+    """Return the reference data kept in memory, reloading it from the catalog file only if the file was changed since the last read or write.
+
+    Returns:
+        pd.DataFrame: Reference data DataFrame, shared by the xlsx and pdf processing.
+    """
+    global log
+    global config
+    global reference_data
+    global reference_signature
+
+    # the SQLite catalog store is updated in place and read only when exporting, so it is not kept in memory
+    if config.catalog_format == "sqlite":
+        return read_catalog_store()
+
+    signature = catalog_signature()
+
+    if reference_data is not None and signature is not None and signature == reference_signature:
+        return reference_data
+
+    if reference_signature is not None:
+        log.info(f"Catalog file changed outside the script, reloading: {config.catalog_store}")
+        if persist_pending:
+            log.warning("Changes not yet saved to the catalog store are discarded and will be processed again.")
+            discard_unsaved()
+        # rows changed outside the script must be merged again, even if the new data is the same already merged
+        clear_row_hashes()
+
+    reference_data = read_catalog_store()
+
+    # only keep the signature if the catalog was read correctly, to force a new read in the next call otherwise
+    # the signature is taken again if the catalog store was created by the read
+    if reference_data.index.name == config.columns_key:
+        reference_signature = signature if signature is not None else catalog_signature()
+        metrics.set("reference_bytes", int(reference_data.memory_usage(deep=True).sum()))
+    else:
+        reference_signature = None
+
+    return reference_data
+
+# --------------------------------------------------------------
+def parse_new_data(file: str, columns_in: list[str], columns_key: str, engine: str) -> tuple[pd.DataFrame, str, float]:
+    """Read an Excel file with new data, checking the header row before reading the whole file.
+
+    Runs in the parse worker processes, so it must not use the global variables.
+
+    Args:
+        file (str): Excel file to read.
+        columns_in (list[str]): Sorted list of the expected columns.
+        columns_key (str): Key column, used as index.
+        engine (str): Excel reader engine, or None for the pandas default.
+
+    Returns:
+        tuple[pd.DataFrame, str, float]: DataFrame with the Excel data, or None and the error message, and the time used to read the file in seconds.
+    """
+
+    start = time.perf_counter()
+
+    try:
+        header = pd.read_excel(file, nrows=0, engine=engine)
+        if sorted(header.columns.astype(str)) != columns_in:
+            return None, "columns do not match the configured input columns", time.perf_counter() - start
+
+        df_from_file = pd.read_excel(file, usecols=columns_in, dtype={columns_key: str}, engine=engine)
+        df_from_file.set_index(columns_key, inplace=True)
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+
+    return df_from_file, None, time.perf_counter() - start
+
+# --------------------------------------------------------------
+def read_new_data(files: list[str]) -> list[pd.DataFrame]:
+    """Read the Excel files with new data, in parallel if there are more than one file and more than one parse worker.
+
+    Args:
+        files (list[str]): Excel files to read.
+
+    Returns:
+        list[pd.DataFrame]: DataFrame for each file, in the same order, or None if the file could not be read or is not valid.
+    """
+    global log
+    global config
+    global parse_pool
+
+    args = (config.columns_in, config.columns_key, EXCEL_ENGINE)
+
+    results = None
+
+    if len(files) > 1 and config.parse_workers > 1:
+        try:
+            if parse_pool is None:
+                parse_pool = ProcessPoolExecutor(max_workers=config.parse_workers)
+
+            # a pool shared with other profiles receives at most parse workers files at a time from each profile, so that a burst in one profile does not delay the others
+            chunk_size = config.parse_workers if shared_pools else len(files)
+            results = []
+            for start in range(0, len(files), chunk_size):
+                futures = [parse_pool.submit(parse_new_data, file, *args) for file in files[start:start + chunk_size]]
+                results.extend(future.result() for future in futures)
+        except Exception as e:
+            log.warning(f"Error in parse workers, reading files sequentially: {e}")
+            results = None
+            if not shared_pools:
+                if parse_pool is not None:
+                    parse_pool.shutdown(cancel_futures=True)
+                parse_pool = None
+
+    if results is None:
+        results = [parse_new_data(file, *args) for file in files]
+
+    new_data = []
+    for file, (new_data_df, error, seconds) in zip(files, results):
+        metrics.observe("parse", seconds)
+        if error:
+            log.error(f"Error reading Excel file {file}: {error}")
+        new_data.append(new_data_df)
+
+    return new_data
+
+# --------------------------------------------------------------
+def valid_data(df: pd.DataFrame) -> bool:
+    """Validate the data in the DataFrame.
+
+    Args:
+        df (pd.DataFrame): DataFrame to validate.
+
+    Returns:
+        bool: True if the data is valid.
+    """
+    global log
+    global config
+    
+    df_columns = df.columns.tolist()
+    df_columns.append(df.index.name)
+
+    if sorted(df_columns) != config.columns_in:
+        return False
+    
+    return True
+
+# --------------------------------------------------------------
+def file_mtime(file: str) -> float:
+    """Return the file modification time, as found in the post folder before the file was moved to the temp folder, or zero if it can't be read.
+
+    Files moved to the temp folder before the script started have the modification time of the move.
+
+    Args:
+        file (str): File to check.
+
+    Returns:
+        float: Modification time in seconds since the epoch.
+    """
+
+    if file in posted_mtimes:
+        return posted_mtimes[file]
+
+    try:
+        return os.path.getmtime(file)
+    except OSError:
+        return 0
+
+# --------------------------------------------------------------
+def merge_reference(new_data_df: pd.DataFrame) -> bool:
+    """Merge new data into the reference data and persist it, updating rows where the key matches and adding the other rows.
+
+    Args:
+        new_data_df (pd.DataFrame): DataFrame with new data, indexed by the key column and without duplicated keys.
+
+    Returns:
+        bool: True if the reference data was updated.
+    """
+    global log
+    global config
+    global export_pending
+
+    metrics.add("rows_merged_total", len(new_data_df))
+
+    if config.catalog_format == "sqlite":
+        try:
+            with metrics.timer("merge"):
+                upsert_catalog_db(new_data_df)
+            export_pending = True
+            return True
+        except Exception as e:
+            log.error(f"Error updating catalog store: {e}")
+            return False
+
+    reference_df = get_reference()
+
+    with metrics.timer("merge"):
+        reference_df, new_data_df = align_schema(reference_df, new_data_df)
+
+        # update the reference data with the new data where index matches
+        reference_df.update(new_data_df)
+
+        # add new_data_df rows where index does not match
+        reference_df = reference_df.combine_first(new_data_df)
+
+    return persist_reference(reference_df, new_data_df.index)
+
+# --------------------------------------------------------------
+def parse_xlsx_files(xlsx_to_process: list[str]) -> tuple[list[str], list[pd.DataFrame]]:
+    """Read and validate the list of xlsx files, moving invalid files to the trash folder.
+
+    Args:
+        xlsx_to_process (list[str]): List of xlsx files to process.
+
+    Returns:
+        tuple[list[str], list[pd.DataFrame]]: Valid files and their data, in modification time order.
+    """
+
+    global log
+    global config
+
+    valid_files = []
+    new_data = []
+
+    # files identical to files already merged are moved to the store folder without reading them
+    hashes = dict(zip(xlsx_to_process, io_map(file_hash, xlsx_to_process)))
+    merged_hashes = ingested_hashes(list(hashes.values()))
+    duplicates = [file for file in xlsx_to_process if hashes[file] in merged_hashes]
+
+    if duplicates:
+        io_map(move_to_store, duplicates)
+        record_ingested(duplicates, [hashes[file] for file in duplicates], "duplicate")
+        metrics.add("files_skipped_total", len(duplicates), reason="duplicate")
+        log.info(f"Skipped {len(duplicates)} files identical to files already merged, moved to store.")
+
+    # process the files in modification time order, so that the most recent data is the last one
+    xlsx_to_process = sorted([file for file in xlsx_to_process if file not in duplicates], key=lambda x: (file_mtime(x), x))
+
+    for file, new_data_df in zip(xlsx_to_process, read_new_data(xlsx_to_process)):
+
+        if new_data_df is None or not valid_data(new_data_df):
+            trash_it(file, overwrite_trash=config.data_overwrite)
+            continue
+
+        new_data_df.attrs["file hash"] = hashes[file]
+        valid_files.append(file)
+        new_data.append(new_data_df)
+
+    return valid_files, new_data
+
+# --------------------------------------------------------------
+def merge_xlsx_files(valid_files: list[str], new_data: list[pd.DataFrame]) -> list[str]:
+    """Merge the data read from the xlsx files into the reference data with a single write and move the files to the store folder.
+
+    Args:
+        valid_files (list[str]): Valid xlsx files, in modification time order.
+        new_data (list[pd.DataFrame]): Data read from each file.
+
+    Returns:
+        list[str]: Keys merged into the reference data.
+    """
+
+    global log
+    global config
+
+    if not new_data:
+        return []
+
+    file_hashes = [new_data_df.attrs.get("file hash") for new_data_df in new_data]
+
+    # join all new data, keeping the last row for each key
+    new_data_df = pd.concat(new_data)
+    new_data_df = new_data_df[~new_data_df.index.duplicated(keep='last')]
+    new_data_df = apply_schema(new_data_df, f"new data from {len(valid_files)} files")
+
+    # rows equal to the rows last merged for the same key are not merged again
+    hashes = row_hashes(new_data_df)
+    changed = changed_rows(hashes)
+    unchanged = len(new_data_df) - int(changed.sum())
+
+    if unchanged:
+        metrics.add("rows_skipped_total", unchanged)
+
+    if not changed.any():
+        log.info(f"Data from {len(valid_files)} files unchanged in the reference data, skipped.")
+        metrics.add("files_skipped_total", len(valid_files), reason="unchanged")
+        record_ingested(valid_files, file_hashes, "unchanged")
+        io_map(move_to_store, valid_files)
+        return []
+
+    new_data_df = new_data_df[changed]
+
+    if not merge_reference(new_data_df):
+        # files are kept in the temp folder to be processed again in the next run
+        return []
+
+    log.info(f"Merged {len(new_data_df)} rows from {len(valid_files)} files into the reference data, {unchanged} unchanged rows skipped.")
+
+    # files are kept in the temp folder until the reference data is saved, to be processed again if the script stops before
+    unsaved_merges.append((valid_files, file_hashes, hashes[changed]))
+    unsaved_files.update(valid_files)
+
+    save_reference()
+
+    return new_data_df.index.tolist()
+
+# --------------------------------------------------------------
+def finish_merges(merges: list[tuple[list[str], list[str], pd.Series]]) -> None:
+    """Record the hashes and move to the store folder the xlsx files whose data was saved to the catalog store.
+
+    Args:
+        merges (list[tuple[list[str], list[str], pd.Series]]): Files, file hashes and row hashes of each merge.
+    """
+
+    for valid_files, file_hashes, hashes in merges:
+        save_row_hashes(hashes)
+        record_ingested(valid_files, file_hashes, "merged")
+
+        # record merged files, so they are not merged again if the script stops before moving them
+        journal_set(valid_files, "merged", hashes=file_hashes)
+
+        io_map(move_to_store, valid_files)
+
+        journal_remove(valid_files)
+
+        unsaved_files.difference_update(valid_files)
+        in_flight.difference_update(valid_files)
+
+# --------------------------------------------------------------
+def file_size(file: str) -> int:
+    """Return the file size in bytes, or zero if it can't be read.
+
+    Args:
+        file (str): File to check.
+
+    Returns:
+        int: File size in bytes.
+    """
+
+    try:
+        return os.path.getsize(file)
+    except OSError:
+        return 0
+
+# --------------------------------------------------------------
+def process_xlsx_files(xlsx_to_process: list[str]) -> list[str]:
+    """Process the list of xlsx files and update the reference data file with a single write.
+
+    All files are validated and merged together before updating the reference data. When the same key is present in more than one file, the row from the most recent file (by modification time) is kept. Files are moved to the store folder only after the reference data is saved.
+
+    Args:
+        xlsx_to_process (list[str]): List of xlsx files to process.
+
+    Returns:
+        list[str]: Keys merged into the reference data.
+    """
+
+    return merge_xlsx_files(*parse_xlsx_files(xlsx_to_process))
+
+# --------------------------------------------------------------
+def get_journal() -> sqlite3.Connection:
+    """Return the connection to the scan state journal, that keeps the processing state of files between runs.
+
+    Returns:
+        sqlite3.Connection: Connection to the journal database.
+    """
+    global config
+    global journal
+
+    if journal is None:
+        # used by the scan and writer threads, always under journal_lock
+        journal = sqlite3.connect(config.journal_file, check_same_thread=False)
+        journal.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT, state TEXT)")
+        journal.execute("CREATE TABLE IF NOT EXISTS ingested (hash TEXT PRIMARY KEY, path TEXT, outcome TEXT, time REAL)")
+        journal.execute("CREATE TABLE IF NOT EXISTS row_hashes (key TEXT PRIMARY KEY, hash INTEGER)")
+        journal.commit()
+
+    return journal
+
+# --------------------------------------------------------------
+def file_hash(file: str) -> str:
+    """Return the SHA-1 hash of the file content.
+
+    Args:
+        file (str): File to hash.
+
+    Returns:
+        str: Hexadecimal hash, or None if the file can't be read.
+    """
+
+    digest = hashlib.sha1()
+    try:
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    except OSError:
+        return None
+
+    return digest.hexdigest()
+
+# --------------------------------------------------------------
+def journal_set(files: list[str], state: str, keep_stat: bool = False, hashes: list[str] = None) -> None:
+    """Record the processing state of the files in the journal.
+
+    Args:
+        files (list[str]): Files to record.
+        state (str): Processing state, "merged" for xlsx files already merged into the reference data or "published" for pdf files already published.
+        keep_stat (bool): True to keep the size, modification time and hash already recorded, e.g. for files that were moved.
+        hashes (list[str]): Hashes of the files, if already computed, to avoid reading the files again.
+    """
+    global log
+
+    if hashes is None:
+        hashes = [None] * len(files)
+
+    rows = []
+    for file, known_hash in zip(files, hashes):
+        if keep_stat:
+            rows.append((file, None, None, None, state))
+            continue
+        try:
+            stat = os.stat(file)
+            rows.append((file, stat.st_size, stat.st_mtime, known_hash or file_hash(file), state))
+        except OSError:
+            rows.append((file, None, None, None, state))
+
+    try:
+        with journal_lock, get_journal() as db:
+            db.executemany("INSERT INTO files (path, size, mtime, hash, state) VALUES (?, ?, ?, ?, ?) "
+                           "ON CONFLICT(path) DO UPDATE SET state = excluded.state, "
+                           "size = COALESCE(excluded.size, size), mtime = COALESCE(excluded.mtime, mtime), hash = COALESCE(excluded.hash, hash)", rows)
+    except Exception as e:
+        log.warning(f"Error updating scan state journal: {e}")
+
+# --------------------------------------------------------------
+def journal_remove(files: list[str]) -> None:
+    """Remove the files from the journal, after their processing is complete.
+
+    Args:
+        files (list[str]): Files to remove.
+    """
+    global log
+
+    try:
+        with journal_lock, get_journal() as db:
+            db.executemany("DELETE FROM files WHERE path = ?", [(file,) for file in files])
+    except Exception as e:
+        log.warning(f"Error updating scan state journal: {e}")
+
+# --------------------------------------------------------------
+def journal_files(state: str) -> dict[str, tuple[int, float]]:
+    """Return the files recorded in the journal with the given state.
+
+    Args:
+        state (str): Processing state.
+
+    Returns:
+        dict[str, tuple[int, float]]: Size and modification time recorded for each file.
+    """
+    global log
+
+    try:
+        with journal_lock:
+            rows = get_journal().execute("SELECT path, size, mtime FROM files WHERE state = ?", (state,)).fetchall()
+    except Exception as e:
+        log.warning(f"Error reading scan state journal: {e}")
+        return {}
+
+    return {path: (size, mtime) for path, size, mtime in rows}
+
+# --------------------------------------------------------------
+def resume_merged(folder_content: list[FolderEntry]) -> list[FolderEntry]:
+    """Move to the store folder the unchanged xlsx files that were already merged into the reference data, e.g. before a crash, without reading them again.
+
+    Args:
+        folder_content (list[FolderEntry]): Files and folders found in the temp folder.
+
+    Returns:
+        list[FolderEntry]: Files and folders that still need to be processed.
+    """
+    global log
+
+    # files in the pipeline are recorded as merged by the catalog writer before it moves them, so they are left to the writer
+    # in_flight is read before the journal, since the writer removes the journal entries before releasing the files
+    busy = set(in_flight)
+
+    merged = {file: stat for file, stat in journal_files("merged").items() if file not in busy}
+    if not merged:
+        return folder_content
+
+    to_process = []
+    resumed = []
+    for entry in folder_content:
+        if merged.get(entry.path) == (entry.size, entry.mtime):
+            move_to_store(entry.path)
+            resumed.append(entry.path)
+        else:
+            to_process.append(entry)
+
+    if resumed:
+        log.info(f"Moved to store {len(resumed)} files already merged into the reference data.")
+
+    journal_remove(list(merged.keys()))
+
+    return to_process
+
+# --------------------------------------------------------------
+def prune_journal() -> None:
+    """Remove from the journal the merged files that are no longer in the temp folder and the hashes of files ingested before the duplicate check period."""
+    global log
+    global config
+
+    merged = journal_files("merged")
+    journal_remove([file for file in merged if not os.path.isfile(file)])
+
+    try:
+        with journal_lock, get_journal() as db:
+            db.execute("DELETE FROM ingested WHERE time < ?", (time.time() - config.duplicate_days * 86400,))
+    except Exception as e:
+        log.warning(f"Error updating scan state journal: {e}")
+
+# --------------------------------------------------------------
+def ingested_hashes(hashes: list[str]) -> set[str]:
+    """Return the file hashes already recorded as ingested in the journal, or merged into reference data not yet saved.
+
+    Args:
+        hashes (list[str]): File hashes to check.
+
+    Returns:
+        set[str]: Hashes of files already ingested.
+    """
+    global log
+
+    hashes = [digest for digest in hashes if digest is not None]
+    found = set()
+
+    try:
+        with journal_lock:
+            db = get_journal()
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = db.execute(f"SELECT hash FROM ingested WHERE hash IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                found.update(row[0] for row in rows)
+    except Exception as e:
+        log.warning(f"Error reading scan state journal: {e}")
+
+    # hashes of merged files are only recorded in the journal when the reference data is saved
+    for _, file_hashes, _ in list(unsaved_merges):
+        found.update(set(hashes).intersection(file_hashes))
+
+    return found
+
+# --------------------------------------------------------------
+def record_ingested(files: list[str], hashes: list[str], outcome: str) -> None:
+    """Record the hash of ingested xlsx files, so that identical files posted again are skipped.
+
+    Args:
+        files (list[str]): Files ingested.
+        hashes (list[str]): Hash of each file.
+        outcome (str): Processing outcome, "merged", "unchanged" or "duplicate".
+    """
+    global log
+
+    now = time.time()
+    rows = [(digest, file, outcome, now) for file, digest in zip(files, hashes) if digest is not None]
+
+    try:
+        with journal_lock, get_journal() as db:
+            db.executemany("INSERT INTO ingested (hash, path, outcome, time) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT(hash) DO UPDATE SET path = excluded.path, outcome = excluded.outcome, time = excluded.time", rows)
+    except Exception as e:
+        log.warning(f"Error updating scan state journal: {e}")
+
+# --------------------------------------------------------------
+def row_hashes(new_data_df: pd.DataFrame) -> pd.Series:
+    """Return a hash of the content of each row, including the key.
+
+    Args:
+        new_data_df (pd.DataFrame): New data, indexed by the key column.
+
+    Returns:
+        pd.Series: Signed 64 bit hash of each row, indexed by the key.
+    """
+
+    # columns are sorted since files may have the columns in different order
+    hashes = pd.util.hash_pandas_object(new_data_df[sorted(new_data_df.columns)], index=True)
+
+    # stored as signed integers, as used by SQLite
+    return pd.Series(hashes.to_numpy().view("int64"), index=hashes.index)
+
+# --------------------------------------------------------------
+def changed_rows(hashes: pd.Series) -> pd.Series:
+    """Compare the row hashes with the hashes recorded when each key was last merged, including merges not yet saved.
+
+    Args:
+        hashes (pd.Series): Row hashes, indexed by the key.
+
+    Returns:
+        pd.Series: True for the rows that are new or changed. All rows are considered changed if the journal can't be read.
+    """
+    global log
+
+    keys = hashes.index.tolist()
+    stored = {}
+
+    try:
+        with journal_lock:
+            db = get_journal()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = db.execute(f"SELECT key, hash FROM row_hashes WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                stored.update(rows)
+    except Exception as e:
+        log.warning(f"Error reading scan state journal: {e}")
+        return pd.Series(True, index=hashes.index)
+
+    # row hashes are only recorded in the journal when the reference data is saved, so the last unsaved merge of each key is used
+    for _, _, merged in list(unsaved_merges):
+        stored.update(merged[merged.index.intersection(hashes.index)].items())
+
+    return pd.Series([stored.get(key) != value for key, value in zip(keys, hashes.tolist())], index=hashes.index, dtype=bool)
+
+# --------------------------------------------------------------
+def save_row_hashes(hashes: pd.Series) -> None:
+    """Record the hashes of the rows merged into the reference data.
+
+    Args:
+        hashes (pd.Series): Row hashes, indexed by the key.
+    """
+    global log
+
+    try:
+        with journal_lock, get_journal() as db:
+            db.executemany("INSERT OR REPLACE INTO row_hashes (key, hash) VALUES (?, ?)", zip(hashes.index.tolist(), hashes.tolist()))
+    except Exception as e:
+        log.warning(f"Error updating scan state journal: {e}")
+
+# --------------------------------------------------------------
+def clear_row_hashes() -> None:
+    """Remove all row hashes, so that all new rows are merged again, e.g. after the catalog was changed outside the script."""
+    global log
+
+    try:
+        with journal_lock, get_journal() as db:
+            db.execute("DELETE FROM row_hashes")
+    except Exception as e:
+        log.warning(f"Error updating scan state journal: {e}")
+
+# --------------------------------------------------------------
+def resume_published() -> None:
+    """Update the screenshot status of pdf files that were published but whose status was not saved, e.g. before a crash."""
+    global log
+
+    # files whose status is waiting for the reference data to be saved are not updated again
+    published = [file for file in journal_files("published") if file not in unsaved_published]
+    if not published:
+        return
+
+    # files whose row is not in the reference data, e.g. merged in a write that was discarded, are kept in the journal until the row is merged again
+    updated = set(set_screenshot_status([os.path.basename(file) for file in published]))
+    published = [file for file in published if os.path.basename(file) in updated]
+    if published:
+        log.info(f"Updated screenshot status for {len(published)} files published in a previous run.")
+        unsaved_published.extend(published)
+        save_reference()
+
+# --------------------------------------------------------------
+def load_pending() -> None:
+    """Load the index of pdf files waiting for the reference data, dropping files that are no longer in the temp folder."""
+    global log
+    global config
+    global pending_screenshots
+
+    try:
+        with open(config.pending_file, 'r', encoding='utf-8') as json_file:
+            pending_screenshots = json.load(json_file)
+    except FileNotFoundError:
+        pending_screenshots = {}
+    except Exception as e:
+        log.warning(f"Error reading pending screenshots file, starting a new one: {e}")
+        pending_screenshots = {}
+
+    prune_pending()
+
+# --------------------------------------------------------------
+def save_pending() -> None:
+    """Write the index of pdf files waiting for the reference data."""
+    global log
+    global config
+
+    try:
+        # copy the index, since it may be changed by another thread while writing
+        with pending_lock, open(config.pending_file, 'w', encoding='utf-8') as json_file:
+            json.dump(dict(pending_screenshots), json_file)
+    except Exception as e:
+        log.warning(f"Error writing pending screenshots file: {e}")
+
+# --------------------------------------------------------------
+def prune_pending() -> None:
+    """Remove from the pending index the pdf files that were moved or removed from the temp folder."""
+    global log
+    global pending_screenshots
+
+    # copy the items, since the index may be changed by the catalog writer thread
+    missing = [filename for filename, item in list(pending_screenshots.items()) if not os.path.isfile(item)]
+
+    if missing:
+        for filename in missing:
+            pending_screenshots.pop(filename, None)
+        log.info(f"Removed {len(missing)} files no longer in the temp folder from the pending screenshots.")
+        save_pending()
+
+# --------------------------------------------------------------
+def not_pending(pdf_to_process: list[str]) -> list[str]:
+    """Return the pdf files that are not waiting in the pending index, which are only processed again when their key is added to the reference data.
+
+    Args:
+        pdf_to_process (list[str]): List of pdf files to process.
+
+    Returns:
+        list[str]: List of pdf files that are not pending.
+    """
+
+    return [item for item in pdf_to_process if pending_screenshots.get(os.path.basename(item)) != item]
+
+# --------------------------------------------------------------
+def pending_matches(keys: list[str] = None) -> list[str]:
+    """Return the pending pdf files whose key is in the list of new keys, or in the reference data if no list is given.
+
+    Args:
+        keys (list[str]): Keys added to the reference data.
+
+    Returns:
+        list[str]: List of pdf files that can now be processed.
+    """
+    global config
+
+    if not pending_screenshots:
+        return []
+
+    filenames = pd.Index(list(pending_screenshots.keys()))
+
+    if keys is not None:
+        found = filenames.isin(keys)
+    elif config.catalog_format == "sqlite":
+        found = filenames.isin(catalog_db_keys(filenames.tolist()))
+    else:
+        found = filenames.isin(get_reference().index)
+
+    return [pending_screenshots[filename] for filename in filenames[found]]
+
+# --------------------------------------------------------------
+def process_pdf_files(pdf_to_process: list[str]) -> None:
+    """Process the list of pdf files and update the reference data file.
+
+    All files are matched against the reference data at once. Matched files are published and the screenshot status of all published files is updated with a single write.
+    Files not found are kept in the pending index, to be processed again only when their key is added to the reference data.
+
+    Args:
+        pdf_to_process (list[str]): List of pdf files to process.
+    """
+    global log
+    global config
+    global pending_screenshots
+
+    filenames = pd.Index([os.path.basename(item) for item in pdf_to_process])
+
+    if config.catalog_format == "sqlite":
+        found = filenames.isin(catalog_db_keys(filenames.tolist()))
+    else:
+        found = filenames.isin(get_reference().index)
+
+    # if file is not present in the reference data, keep it in the pending index and wait for its key to appear later.
+    new_pending = 0
+    for item, filename, is_found in zip(pdf_to_process, filenames, found):
+        if not is_found and pending_screenshots.get(filename) != item:
+            pending_screenshots[filename] = item
+            new_pending += 1
+
+    if new_pending:
+        log.info(f"{new_pending} files not found in the reference data, waiting for it to be updated. Total pending: {len(pending_screenshots)}")
+
+    found_files = [item for item, is_found in zip(pdf_to_process, found) if is_found]
+    with metrics.timer("publish"):
+        published_files = [item for item, is_published in zip(found_files, io_map(publish, found_files)) if is_published]
+    published = [os.path.basename(item) for item in published_files]
+
+    # files found are removed from the pending index even if not published, to be tried again in the next scan
+    found_pending = [filename for filename in filenames[found] if pending_screenshots.pop(filename, None) is not None]
+
+    if new_pending or found_pending:
+        save_pending()
+
+    metrics.set("pdf_pending", len(pending_screenshots))
+
+    if not published:
+        return
+
+    # record published files, so their status is updated later if the script stops or the update fails
+    journal_set(published_files, "published", keep_stat=True)
+
+    updated = set(set_screenshot_status(published))
+    published_files = [item for item in published_files if os.path.basename(item) in updated]
+    if published_files:
+        log.info(f"Updated screenshot status for {len(published_files)} files.")
+        # the journal entries are removed after the reference data is saved, and entries of files not updated are kept to be updated by resume_published
+        unsaved_published.extend(published_files)
+        save_reference()
+
+# --------------------------------------------------------------
+def set_screenshot_status(keys: list[str]) -> list[str]:
+    """Set the screenshot status for the published files and persist the reference data.
+
+    Args:
+        keys (list[str]): Keys of the published screenshots.
+
+    Returns:
+        list[str]: Keys found in the reference data and updated. Keys not found, e.g. of rows merged in a write that was discarded, are not updated.
+    """
+    global log
+    global config
+    global export_pending
+
+    if config.catalog_format == "sqlite":
+        try:
+            keys = list(catalog_db_keys(keys))
+            if keys:
+                set_status_catalog_db(keys)
+                export_pending = True
+            return keys
+        except Exception as e:
+            log.error(f"Error updating catalog store: {e}")
+            return []
+
+    reference_df = get_reference()
+    keys = reference_df.index.intersection(keys)
+    if keys.empty:
+        return []
+
+    reference_df.loc[keys, "status_screenshot"] = 1
+    persist_reference(reference_df, keys)
+    return keys.tolist()
+
+# --------------------------------------------------------------
+def persist_reference(reference_df: pd.DataFrame, keys: pd.Index) -> bool:
+    """Keep the reference DataFrame in memory as the current reference data, to be saved to the catalog store by save_reference.
+
+    Args:
+        reference_df (pd.DataFrame): The reference DataFrame to be saved.
+        keys (pd.Index): Keys of the rows changed, used to write only the catalog shards changed.
+
+    Returns:
+        bool: True, as the reference data was updated.
+    """
+    global reference_data
+    global persist_pending
+    global changed_keys
+
+    reference_data = reference_df
+    persist_pending = True
+
+    if changed_keys is not None:
+        changed_keys.update(keys)
+
+    return True
+
+# --------------------------------------------------------------
+def save_reference(force: bool = False) -> bool:
+    """Save the reference data to the catalog store at most once every write window, coalescing the changes made within the window.
+
+    After the reference data is saved, the merged xlsx files are moved to the store folder and the journal entries of the published pdf files are removed.
+    If the save fails, the changes are discarded, to be processed again.
+
+    Args:
+        force (bool): True to save regardless of the write window, e.g. at shutdown.
+
+    Returns:
+        bool: True if there are no changes left to save.
+    """
+    global config
+    global persist_pending
+    global last_persist
+    global unsaved_merges
+    global unsaved_published
+
+    if persist_pending:
+        if not force and time.time() - last_persist < config.write_window:
+            return False
+
+        persist_pending = False
+        last_persist = time.time()
+
+        if not write_reference(reference_data):
+            discard_unsaved()
+            return False
+
+    # the SQLite catalog store is updated in place, so merges are finished without a write
+    merges, unsaved_merges = unsaved_merges, []
+    published, unsaved_published = unsaved_published, []
+
+    finish_merges(merges)
+
+    if published:
+        journal_remove(published)
+
+    return True
+
+# --------------------------------------------------------------
+def discard_unsaved() -> None:
+    """Discard the changes not saved to the catalog store. Merged xlsx files are released to be found by the next scan and published pdf files are kept in the journal to have the status updated again."""
+    global persist_pending
+    global reference_signature
+    global unsaved_merges
+    global unsaved_published
+
+    persist_pending = False
+
+    # force reading the catalog file again
+    reference_signature = None
+
+    for valid_files, _, _ in unsaved_merges:
+        unsaved_files.difference_update(valid_files)
+        in_flight.difference_update(valid_files)
+
+    unsaved_merges = []
+    unsaved_published = []
+
+# --------------------------------------------------------------
+def write_reference(reference_df: pd.DataFrame) -> bool:
+    """Write the reference DataFrame to the catalog store.
+
+    If a columnar store is used, the Excel catalog file is only updated by export_catalog.
+
+    Args:
+        reference_df (pd.DataFrame): The reference DataFrame to be saved.
+
+    Returns:
+        bool: True if the catalog store was updated.
+    """
+    global log
+    global config
+    global reference_signature
+    global export_pending
+
+    if config.catalog_format == "xlsx":
+        # the Excel catalog is the catalog store, so its export is also the persistence stage
+        with metrics.timer("persist"):
+            saved = export_catalog(reference_df)
+        if saved:
+            metrics.set("persist_bytes", file_size(config.catalog))
+    else:
+        try:
+            with metrics.timer("persist"):
+                write_catalog_store(reference_df)
+            if not config.partition_by:
+                metrics.set("persist_bytes", file_size(config.catalog_store))
+            log.info(f"Catalog store updated: {config.catalog_store}")
+            export_pending = True
+            saved = True
+        except Exception as e:
+            log.error(f"Error saving catalog store: {e}")
+            saved = False
+
+    if saved:
+        reference_signature = catalog_signature()
+
+    return saved
+
+# --------------------------------------------------------------
+def write_excel_streaming(reference_df: pd.DataFrame, file: str) -> None:
+    """Write the reference DataFrame to an Excel file with a write-only workbook, that writes each row to the file as it is added, converting the values in chunks of rows, so that the memory used does not grow with the size of the catalog.
+
+    Args:
+        reference_df (pd.DataFrame): DataFrame indexed by the key column.
+        file (str): Excel file to write.
+    """
+    global config
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    sheet.append(config.columns_out)
+
+    for start in range(0, len(reference_df), EXPORT_CHUNK_ROWS):
+        chunk = reference_df.iloc[start:start + EXPORT_CHUNK_ROWS]
+
+        # the key column is read from the index, without a reset_index copy of the whole DataFrame, and missing values are written as empty cells
+        columns = []
+        for column in config.columns_out:
+            values = chunk.index.to_series() if column == config.columns_key else chunk[column]
+            columns.append(values.astype(object).where(values.notna(), None).to_list())
+
+        for row in zip(*columns):
+            sheet.append(row)
+
+    workbook.save(file)
+
+# --------------------------------------------------------------
+def export_catalog(reference_df: pd.DataFrame) -> bool:
+    """Export the reference DataFrame to the Excel catalog file.
+
+    Args:
+        reference_df (pd.DataFrame): The reference DataFrame to be exported.
+
+    Returns:
+        bool: True if the catalog file was updated.
+    """
+    global log
+    global config
+
+    # the file is written to a temporary file and then replaced, so users and sync clients never see a partial file
+    base, extension = os.path.splitext(config.catalog)
+    temp_file = f"{base}.tmp{extension}"
+
+    try:
+        with metrics.timer("export"):
+            # the index column is exported as a regular column and the columns are written in the order defined in the config file as columns_out
+            # reset_index or selecting the columns would copy the whole DataFrame, so the indexed DataFrame is written as it is when it is already in that order
+            in_order = [reference_df.index.name, *reference_df.columns] == config.columns_out
+            if config.streaming_export or not in_order:
+                write_excel_streaming(reference_df, temp_file)
+            else:
+                reference_df.to_excel(temp_file)
+            os.replace(temp_file, config.catalog)
+        metrics.set("export_bytes", file_size(config.catalog))
+        log.info(f"Reference data file updated: {config.catalog}")
+        return True
+    except Exception as e:
+        log.error(f"Error saving reference data: {e}")
+        return False
+
+# --------------------------------------------------------------
+def export_if_due(force: bool = False) -> None:
+    """Export the Excel catalog file from the catalog store if there are changes and the export period is over, or if an export was requested.
+
+    An export can be requested at any time by creating the export request file, that is removed after the export.
+
+    Args:
+        force (bool): True to export pending changes regardless of the export period, e.g. at shutdown.
+    """
+    global log
+    global config
+    global export_pending
+    global last_export
+
+    if config.catalog_format == "xlsx":
+        return
+
+    requested = config.export_request is not None and os.path.exists(config.export_request)
+
+    if not requested:
+        if not export_pending:
+            return
+        if not force and time.time() - last_export < config.export_period * 60:
+            return
+
+    # changes within the write window are saved first, so the export matches the catalog store
+    save_reference(force=True)
+
+    if export_catalog(get_reference()):
+        export_pending = False
+        last_export = time.time()
+
+    if requested:
+        try:
+            os.remove(config.export_request)
+            log.info("Catalog export request completed.")
+        except Exception as e:
+            log.warning(f"Error removing export request file {config.export_request}: {e}")
+
+# --------------------------------------------------------------
+def is_clean_time() -> bool:
+    """Check if the clean period is over since the last clean.
+
+    Returns:
+        bool: True if it's time to clean the folders.
+    """
+    global config
+
+    return pd.to_datetime("now") - config.last_clean > pd.Timedelta(hours=config.clean_period)
+
+# --------------------------------------------------------------
+def clean_folders() -> None:
+    """Check if it's time to clean the post folder and update the last clean time in the config file. Delete the next batch of files due by the trash retention."""
+    global config
+
+    if is_clean_time():
+        with metrics.timer("clean"):
+            clean_old_in_folder(config.post)
+            clean_old_in_folder(config.temp)
+            prune_pending()
+            prune_journal()
+            plan_trash_sweep()
+        config.set_last_clean()
+
+    sweep_trash()
+
+# --------------------------------------------------------------
+def sleep_while_watching(seconds: float) -> None:
+    """Sleep for the given time, waking up every second to stop as soon as a stop signal is received.
+
+    Args:
+        seconds (float): Time to sleep in seconds.
+    """
+
+    deadline = time.monotonic() + seconds
+    while keep_watching and time.monotonic() < deadline:
+        time.sleep(min(1, max(0, deadline - time.monotonic())))
+
+# --------------------------------------------------------------
+def next_check_period(check_period: float, busy: bool) -> float:
+    """Return the period until the next check of the folders, doubling it while the folders are quiet, up to the max check period, and returning to the check period when files are found.
+
+    Args:
+        check_period (float): Current check period in seconds.
+        busy (bool): True if files were found or are waiting to be processed.
+
+    Returns:
+        float: Next check period in seconds.
+    """
+    global config
+
+    if busy:
+        return config.check_period
+
+    return min(check_period * 2, config.max_check_period)
+
+# --------------------------------------------------------------
+def add_to_backlog(backlog: dict[str, tuple[float, str]], xlsx_to_process: list[str], pdf_to_process: list[str]) -> None:
+    """Add the files found to the backlog of files waiting to be sent to the pipeline.
+
+    Files are ordered by the time they were first found, with xlsx files handled as older by the xlsx priority, so that their keys are available to the pdf files, without pdf files waiting indefinitely during bursts of xlsx files.
+
+    Args:
+        backlog (dict[str, tuple[float, str]]): Files waiting to be processed, with the time used to order them and the file type. Changed in place.
+        xlsx_to_process (list[str]): xlsx files found.
+        pdf_to_process (list[str]): pdf files found.
+    """
+    global config
+
+    now = time.time()
+    for item in xlsx_to_process:
+        backlog.setdefault(item, (now - config.xlsx_priority, "xlsx"))
+    for item in pdf_to_process:
+        backlog.setdefault(item, (now, "pdf"))
+
+# --------------------------------------------------------------
+def next_batch(backlog: dict[str, tuple[float, str]]) -> tuple[list[str], list[str]]:
+    """Remove from the backlog and return the next batch, with at most files per cycle files, oldest first.
+
+    Args:
+        backlog (dict[str, tuple[float, str]]): Files waiting to be processed. Changed in place.
+
+    Returns:
+        tuple[list[str], list[str]]: xlsx and pdf files of the next batch.
+    """
+    global config
+
+    if config.files_per_cycle and len(backlog) > config.files_per_cycle:
+        batch = sorted(backlog, key=backlog.get)[:config.files_per_cycle]
+    else:
+        batch = list(backlog)
+
+    xlsx_batch = []
+    pdf_batch = []
+    for item in batch:
+        if backlog.pop(item)[1] == "xlsx":
+            xlsx_batch.append(item)
+        else:
+            pdf_batch.append(item)
+
+    return xlsx_batch, pdf_batch
+
+# --------------------------------------------------------------
+def write_metrics(force: bool = False) -> None:
+    """Write the Prometheus metrics file and the JSON status file, at most once every metrics period.
+
+    Files are written to a temporary file and then replaced, so readers never see a partial file.
+
+    Args:
+        force (bool): True to write regardless of the metrics period, e.g. at shutdown.
+    """
+    global log
+    global config
+    global last_metrics
+
+    if not force and time.time() - last_metrics < config.metrics_period:
+        return
+
+    last_metrics = time.time()
+    metrics.set("pdf_pending", len(pending_screenshots))
+    metrics.set("files_in_process", len(in_flight))
+
+    try:
+        with open(f"{config.metrics_file}.tmp", 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(metrics.prometheus())
+        os.replace(f"{config.metrics_file}.tmp", config.metrics_file)
+
+        with open(f"{config.status_file}.tmp", 'w', encoding='utf-8') as status_file:
+            json.dump(metrics.status(), status_file, indent=4)
+        os.replace(f"{config.status_file}.tmp", config.status_file)
+    except Exception as e:
+        log.warning(f"Error writing metrics files: {e}")
+
+# --------------------------------------------------------------
+def parse_stage(parse_queue: queue.Queue, merge_queue: queue.Queue) -> None:
+    """Pipeline stage that reads the xlsx files of each batch using the parse workers and forwards the data to the catalog writer.
+
+    Runs until a None batch is received, after processing all batches before it.
+
+    Args:
+        parse_queue (queue.Queue): Batches of xlsx and pdf files to process.
+        merge_queue (queue.Queue): Batches with the data read, for the catalog writer.
+    """
+    global log
+
+    while True:
+        batch = parse_queue.get()
+
+        if batch is None:
+            merge_queue.put(None)
+            return
+
+        xlsx_to_process, pdf_to_process = batch
+
+        profiler.start("parse")
+        try:
+            valid_files, new_data = parse_xlsx_files(xlsx_to_process)
+        except Exception as e:
+            log.exception(f"Error reading xlsx files: {e}")
+            valid_files, new_data = [], []
+        finally:
+            profiler.stop("parse")
+
+        # invalid files were moved to trash and files not read stay in temp to be found by the next scan
+        in_flight.difference_update(set(xlsx_to_process).difference(valid_files))
+
+        merge_queue.put((valid_files, new_data, pdf_to_process))
+
+# --------------------------------------------------------------
+def catalog_writer(merge_queue: queue.Queue) -> None:
+    """Pipeline stage that owns the reference data, merging the new data, processing pdf files and exporting the catalog.
+
+    Runs until a None batch is received, after processing all batches before it.
+
+    Args:
+        merge_queue (queue.Queue): Batches with the data read from xlsx files and the pdf files to process.
+    """
+    global log
+    global config
+
+    # pending pdf files whose key was added to the reference data while the script was not running are processed in the first iteration
+    pending_to_process = pending_matches()
+
+    while True:
+        try:
+            batch = merge_queue.get(timeout=config.check_period)
+        except queue.Empty:
+            batch = ([], [], [])
+
+        if batch is None:
+            save_reference(force=True)
+            return
+
+        valid_files, new_data, pdf_to_process = batch
+
+        profiler.start("writer")
+        try:
+            resume_published()
+
+            if new_data:
+                pending_to_process.extend(pending_matches(merge_xlsx_files(valid_files, new_data)))
+
+            if pending_to_process:
+                pdf_to_process = pdf_to_process + list(set(pending_to_process).difference(pdf_to_process))
+                pending_to_process = []
+
+            if pdf_to_process:
+                process_pdf_files(pdf_to_process)
+
+            save_reference()
+
+            export_if_due()
+
+        except Exception as e:
+            log.exception(f"Error in catalog writer: {e}")
+
+        finally:
+            profiler.stop("writer")
+
+            # merged files are released after the reference data is saved
+            in_flight.difference_update(set(valid_files).difference(unsaved_files))
+            in_flight.difference_update(pdf_to_process)
+
+# --------------------------------------------------------------
+# Main function
+# --------------------------------------------------------------
+
+# Register the signal handler function, to handle system kill commands
+signal.signal(signal.SIGTERM, sigterm_handler)
+signal.signal(signal.SIGINT, sigint_handler)
+if hasattr(signal, "SIGUSR1"):
+    signal.signal(signal.SIGUSR1, profile_handler)
+
+def main(loaded_config: Config = None):
+    """Main function
+
+    Args:
+        loaded_config (Config): Config already read and validated, e.g. by the profile daemon. Default: read from CONFIG_FILE.
+    """
+    
     global config
     global keep_watching
     
-    config = Config()
+    config = loaded_config if loaded_config is not None else Config()
     
     start_logging()
-    
+
+    watcher = None
+    if config.event_watch:
+        if Observer is None:
+            log.warning("Event watch requires the watchdog package. Using folder polling instead.")
+        else:
+            try:
+                watcher = FolderWatcher(config.post, config.debounce)
+                log.info(f"Watching {config.post} for file system events.")
+            except Exception as e:
+                log.warning(f"Error starting event watch, using folder polling instead: {e}")
+
+    load_pending()
+
+    # files are moved and classified in this thread, read by the parse stage and merged by the catalog writer
+    # the queues are bounded, so when the pipeline is full the files found wait in the backlog, and this thread keeps cleaning and checking for stop signals
+    parse_queue = queue.Queue(maxsize=config.queue_size)
+    merge_queue = queue.Queue(maxsize=config.queue_size)
+    parser = threading.Thread(target=parse_stage, args=(parse_queue, merge_queue), name="parse")
+    writer = threading.Thread(target=catalog_writer, args=(merge_queue,), name="writer")
+    parser.start()
+    writer.start()
+
+    # first iteration always scan the folders, to process files posted while the script was not running
+    full_scan = True
+
+    # files found that were not sent to the pipeline yet, and the current check period, that grows while the folders are quiet
+    backlog = {}
+    check_period = config.check_period
+
     # keep thread running until a crtl+C or kill command is received, even if an error occurs
     while keep_watching:
-        
+
         try:
-            xlsx_to_process, pdf_to_process = get_files_to_process()
-            
-            if xlsx_to_process:
-                process_xlsx_files(xlsx_to_process)
-                    
-            if pdf_to_process:
-                process_pdf_files(pdf_to_process)
-            
+            profiler.check_request()
+            profiler.start("main")
+
+            if watcher is not None and not watcher.observer.is_alive():
+                log.warning("Event watch stopped, using folder polling instead.")
+                watcher = None
+
+            # scan the folders before cleaning, to catch any file whose event was lost before it is trashed as old
+            # when polling, the folders are not scanned again while the backlog has enough files for the next cycle
+            if is_clean_time() or (watcher is None and (not config.files_per_cycle or len(backlog) < config.files_per_cycle)):
+                full_scan = True
+
+            if full_scan:
+                with metrics.timer("scan"):
+                    xlsx_to_process, pdf_to_process = get_files_to_process()
+                full_scan = False
+
+                # a full scan finds all files waiting in the temp folder, so files in the backlog that were not found are no longer there
+                found = set(xlsx_to_process).union(pdf_to_process)
+                backlog = {item: value for item, value in backlog.items() if item in found}
+            elif watcher is not None:
+                # do not wait for events while there are files in the backlog and room in the pipeline
+                changed = watcher.wait_for_changes(0 if backlog and not parse_queue.full() else check_period)
+                with metrics.timer("scan"):
+                    xlsx_to_process, pdf_to_process = get_changed_files_to_process(changed)
+            else:
+                xlsx_to_process, pdf_to_process = [], []
+
+            # files still in the pipeline are found again when scanning the temp folder
+            xlsx_to_process = [item for item in xlsx_to_process if item not in in_flight]
+            pdf_to_process = [item for item in pdf_to_process if item not in in_flight]
+
+            check_period = next_check_period(check_period, bool(xlsx_to_process or pdf_to_process or backlog))
+
+            add_to_backlog(backlog, xlsx_to_process, pdf_to_process)
+
+            # when the pipeline is full, files wait in the backlog without blocking this thread
+            if not parse_queue.full():
+                xlsx_to_process, pdf_to_process = next_batch(backlog)
+                if xlsx_to_process or pdf_to_process:
+                    in_flight.update(xlsx_to_process)
+                    in_flight.update(pdf_to_process)
+                    parse_queue.put((xlsx_to_process, pdf_to_process))
+
+            metrics.set("backlog_files", len(backlog))
+            metrics.set("check_period_seconds", check_period)
+
             clean_folders()
-            
-            time.sleep(config.check_period)
-        
+
+            write_metrics()
+
+            profiler.stop("main")
+            profiler.end_cycle()
+
+            if watcher is None:
+                sleep_while_watching(config.check_period if backlog else check_period)
+
         except Exception as e:
+            profiler.stop("main")
             log.exception(f"Error in main loop: {e}")
             continue
 
+    if watcher is not None:
+        watcher.stop()
+
+    # process all files already in the pipeline before stopping
+    log.info("Waiting for files in process...")
+    parse_queue.put(None)
+    parser.join()
+    writer.join()
+
+    # a shared parse pool is shut down by the profile daemon
+    if parse_pool is not None and not shared_pools:
+        parse_pool.shutdown()
+
+    if io_pool is not None:
+        io_pool.shutdown()
+
+    export_if_due(force=True)
+
+    write_metrics(force=True)
+
     log.info("File catalog script stopped.")
+
+    stop_logging()
     
 if __name__ == "__main__":
     main()
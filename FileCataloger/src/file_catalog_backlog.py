@@ -0,0 +1,136 @@
+#!/usr/bin/python
+"""
+Process all files in the post and temp folders in a single run, e.g. to catch up after an outage, and exit with a summary.
+
+Uses the same config file and processing functions of file_catalog.py, but without the watch loop:
+xlsx files are read by parse workers using all CPUs, in batches, and merged into the reference data in memory, that is saved to the catalog store only once, after all batches.
+pdf files are published after all xlsx files are merged, so that all keys in the backlog are found.
+
+file_catalog.py must not be running with the same config file at the same time.
+
+Args (command line):
+    config: Config file. Default: file_catalog.CONFIG_FILE
+    --parse-workers: Parse worker processes. Default: number of CPUs
+    --io-workers: Threads used to move files. Default: io workers in the config file
+    --batch-size: Number of xlsx files read before each merge, limiting the memory used. Default: 1000
+
+Returns (stdout): Summary with the number of files and rows processed and the processing rate. Exit code is 1 if the catalog store could not be saved.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import file_catalog as fc
+
+# --------------------------------------------------------------
+def counter(name: str, **labels) -> int:
+    """Return the value of a metrics counter.
+
+    Args:
+        name (str): Counter name.
+        **labels: Labels identifying the counter.
+
+    Returns:
+        int: Counter value.
+    """
+
+    return int(fc.metrics.counters.get((name, tuple(sorted(labels.items()))), 0))
+
+# --------------------------------------------------------------
+def ingest_backlog(batch_size: int) -> bool:
+    """Process all files in the post and temp folders with a single save of the catalog store.
+
+    Args:
+        batch_size (int): Number of xlsx files read before each merge.
+
+    Returns:
+        bool: True if the catalog store was saved.
+    """
+
+    # changes are kept in memory until all files are processed
+    fc.config.write_window = float("inf")
+
+    fc.load_pending()
+    fc.resume_published()
+
+    xlsx_to_process, pdf_to_process = fc.get_files_to_process()
+    fc.log.info(f"Backlog with {len(xlsx_to_process)} xlsx files and {len(pdf_to_process)} pdf files.")
+
+    # batches in modification time order, so that the most recent data is the last one merged
+    xlsx_to_process = sorted(xlsx_to_process, key=lambda x: (fc.file_mtime(x), x))
+
+    for start in range(0, len(xlsx_to_process), batch_size):
+        fc.merge_xlsx_files(*fc.parse_xlsx_files(xlsx_to_process[start:start + batch_size]))
+        fc.log.info(f"Read {min(start + batch_size, len(xlsx_to_process))} of {len(xlsx_to_process)} xlsx files.")
+
+    # pending pdf files are matched against all keys merged from the backlog
+    pdf_to_process = pdf_to_process + list(set(fc.pending_matches()).difference(pdf_to_process))
+    if pdf_to_process:
+        fc.process_pdf_files(pdf_to_process)
+
+    saved = fc.save_reference(force=True)
+
+    fc.export_if_due(force=True)
+
+    return saved
+
+# --------------------------------------------------------------
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(description="Process a backlog of files in a single run")
+    parser.add_argument("config", nargs="?", default=fc.CONFIG_FILE)
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--io-workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    fc.CONFIG_FILE = args.config
+    fc.config = fc.Config()
+    fc.config.parse_workers = args.parse_workers
+    if args.io_workers is not None:
+        fc.config.io_workers = args.io_workers
+    fc.start_logging()
+
+    start = time.perf_counter()
+
+    try:
+        saved = ingest_backlog(args.batch_size)
+    except Exception as e:
+        fc.log.exception(f"Error processing backlog: {e}")
+        saved = False
+    finally:
+        if fc.parse_pool is not None:
+            fc.parse_pool.shutdown()
+        if fc.io_pool is not None:
+            fc.io_pool.shutdown()
+
+    seconds = time.perf_counter() - start
+
+    merged = counter("files_total", action="moved to store")
+    published = counter("files_total", action="published")
+    rows = counter("rows_merged_total")
+
+    summary = [f"Backlog processed in {seconds:.1f} s",
+               f"xlsx files merged or skipped: {merged}",
+               f"xlsx files skipped as duplicates: {counter('files_skipped_total', reason='duplicate')}",
+               f"files moved to trash: {counter('files_total', action='moved to trash')}",
+               f"rows merged: {rows}",
+               f"rows skipped as unchanged: {counter('rows_skipped_total')}",
+               f"pdf files published: {published}",
+               f"pdf files pending: {len(fc.pending_screenshots)}",
+               f"rate: {(merged + published) / seconds:.1f} files/s, {rows / seconds:.1f} rows/s",
+               f"catalog store saved: {saved}"]
+
+    for line in summary:
+        fc.log.info(line)
+    fc.stop_logging()
+
+    print("\n".join(summary))
+
+    sys.exit(0 if saved else 1)
+
+if __name__ == "__main__":
+    main()
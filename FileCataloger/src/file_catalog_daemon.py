@@ -0,0 +1,165 @@
+#!/usr/bin/python
+"""
+Run several file catalog profiles in a single process.
+
+Each profile is a config file as used by file_catalog.py, with its own folders, columns, key, catalog, state folder and log.
+Each profile is run by a separate instance of the file_catalog module, in its own thread, so that it keeps its own state, while pandas and the other packages are loaded only once and all profiles share the same pool of parse worker processes.
+
+The profiles file is a JSON file encoded with UTF-8 and with the following tags:
+    {
+        "parse workers":4,
+        "profiles":[
+            "C:/ProgramData/Anatel/FileCataloger/config.json",
+            "C:/ProgramData/Anatel/FileCataloger/Other/config.json"]
+    }
+
+Profiles must use different state folders and log names.
+
+Args (command line): Profiles file. Default: PROFILES_FILE
+Args (stdin): ctrl+c will soft stop all profiles similar to kill command or systemd stop <service>. kill -9 will hard stop. kill -USR1 will profile the next cycles of all profiles.
+
+Returns (stdout): As log messages of each profile, if screen output in log is set to True.
+"""
+
+import importlib.util
+import json
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from types import ModuleType
+
+import file_catalog
+
+# Global Constants
+PROFILES_FILE = "C:/ProgramData/Anatel/FileCataloger/profiles.json"
+
+# Global variables
+profiles = []
+
+# --------------------------------------------------------------
+def stop_handler(signal=None, frame=None) -> None:
+    """Signal handler for SIGTERM and SIGINT to stop all profiles."""
+
+    print("Stop signal received, stopping all profiles...")
+    for profile in profiles:
+        profile.keep_watching = False
+
+# --------------------------------------------------------------
+def profile_handler(signal=None, frame=None) -> None:
+    """Signal handler for SIGUSR1 to profile the next cycles of all profiles."""
+
+    for profile in profiles:
+        profile.profiler.requested = True
+
+# --------------------------------------------------------------
+def load_profile(config_file: str, number: int, parse_pool: ProcessPoolExecutor) -> ModuleType:
+    """Create a new instance of the file_catalog module for the profile and load its config file.
+
+    Args:
+        config_file (str): Config file of the profile.
+        number (int): Profile number, used to name the module instance.
+        parse_pool (ProcessPoolExecutor): Parse worker pool shared by all profiles.
+
+    Returns:
+        ModuleType: Module instance for the profile, or None if the config file is not valid.
+    """
+
+    spec = importlib.util.spec_from_file_location(f"file_catalog_profile_{number}", file_catalog.__file__)
+    profile = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = profile
+    spec.loader.exec_module(profile)
+
+    profile.CONFIG_FILE = config_file
+
+    try:
+        profile.config = profile.Config()
+    except SystemExit:
+        print(f"Profile not loaded, invalid config file: {config_file}")
+        return None
+
+    # the parse workers run the function from the file_catalog module, that can be imported by the worker processes
+    profile.parse_new_data = file_catalog.parse_new_data
+    profile.parse_pool = parse_pool
+    profile.shared_pools = True
+
+    # tracemalloc is shared by the process, so it is only stopped when no profile is using it
+    profile.memory_tracing = file_catalog.memory_tracing
+
+    return profile
+
+# --------------------------------------------------------------
+def run_profile(profile: ModuleType) -> None:
+    """Run the main loop of the profile until it is stopped.
+
+    Args:
+        profile (ModuleType): Module instance for the profile.
+    """
+
+    # the config read when loading the profile is used, so that it is read and validated only once
+    try:
+        profile.main(profile.config)
+    except BaseException as e:
+        print(f"Profile {profile.CONFIG_FILE} stopped with error: {e}")
+
+# --------------------------------------------------------------
+def main():
+    """Main function"""
+
+    global profiles
+
+    profiles_file = sys.argv[1] if len(sys.argv) > 1 else PROFILES_FILE
+
+    try:
+        with open(profiles_file, 'r', encoding='utf-8') as json_file:
+            raw = json.load(json_file)
+    except FileNotFoundError:
+        print(f"Profiles file not found in path: {profiles_file}")
+        exit(1)
+
+    parse_pool = ProcessPoolExecutor(max_workers=raw.get("parse workers", os.cpu_count()))
+
+    state_folders = set()
+    log_names = set()
+    for number, config_file in enumerate(raw["profiles"]):
+        profile = load_profile(config_file, number, parse_pool)
+        if profile is None:
+            continue
+
+        # profiles sharing the state folder or the log name would overwrite each other's journal, pending index and log
+        state_folder = os.path.normcase(os.path.abspath(profile.config.state_folder))
+        if state_folder in state_folders or profile.config.log_name in log_names:
+            print(f"Profile not loaded, state folder or log name already used by another profile: {config_file}")
+            continue
+
+        state_folders.add(state_folder)
+        log_names.add(profile.config.log_name)
+        profiles.append(profile)
+
+    if not profiles:
+        print("No valid profile to run.")
+        parse_pool.shutdown()
+        exit(1)
+
+    # registered after loading the profiles, replacing the handlers registered by each module instance
+    signal.signal(signal.SIGTERM, stop_handler)
+    signal.signal(signal.SIGINT, stop_handler)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profile_handler)
+
+    threads = [threading.Thread(target=run_profile, args=(profile,), name=profile.config.log_name) for profile in profiles]
+    for thread in threads:
+        thread.start()
+
+    # join with timeout, so that signals are handled by the main thread
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(timeout=1)
+
+    parse_pool.shutdown()
+
+    print("File catalog daemon stopped.")
+
+if __name__ == "__main__":
+    main()